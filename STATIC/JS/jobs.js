@@ -0,0 +1,23 @@
+/*Polls a background job until it is finished, then shows its result and refreshes the template table*/
+function pollJob(jobId) {
+    $.getJSON("/jobs/" + jobId, function (job) {
+        var status = $("#job-status");
+        if (job.status === "done" || job.status === "failed") {
+            var success = job.status === "done";
+            status.addClass(success ? "alert--success" : "alert--danger");
+            status.text((success ? "Success: " : "Error: ") + job.message);
+            $("tbody").load("/" + window.location.search + " tbody > *");
+            $(".loader").parent().hide();
+            return;
+        }
+        var progress = job.progress ? " (" + job.progress.done + "/" + job.progress.total + ")" : "";
+        status.text("Job is " + job.status + progress);
+        setTimeout(function () { pollJob(jobId); }, 2000);
+    });
+}
+
+$(document).ready(function () {
+    $("#job-status").each(function () {
+        pollJob($(this).data("job"));
+    });
+});
@@ -0,0 +1,348 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def blob_sha(content):
+    data = content.encode()
+    return hashlib.sha1(b"blob " + str(len(data)).encode() + b"\0" + data).hexdigest()
+
+
+class RequestLog(object):
+    """
+    Thread safe record of the requests answered by a mock server: (operation, method, route, status, bytes, seconds)
+    """
+
+    def __init__(self):
+        self.records = []
+        self.operation = None
+        self.lock = threading.Lock()
+
+    def add(self, method, route, status, size, seconds):
+        with self.lock:
+            self.records.append((self.operation, method, route, status, size, seconds))
+
+    def for_operation(self, operation):
+        with self.lock:
+            return [record for record in self.records if record[0] == operation]
+
+    def clear(self):
+        with self.lock:
+            self.records = []
+
+
+class MockServer(object):
+    """
+    Local HTTP server answering with handle(method, path, query, body) -> (status, body, headers)
+    Every request is delayed by latency seconds (+/- jitter) and requests above rate_limit per second are answered
+    with 429 and a Retry-After header, like the real backends do
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.log = RequestLog()
+        self.lock = threading.Lock()
+        self.window = (0, 0)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0}".format(self.server.server_address[1])
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def route(self, path):
+        # groups the urls by endpoint for the report, ids are replaced with placeholders
+        return re.sub(r"/[0-9a-f]{16,}|/t-[^/]+|/p-[^/]+", "/{id}", path)
+
+    def throttled(self):
+        if self.rate_limit is None:
+            return False
+        with self.lock:
+            second, count = self.window
+            now = int(time.time())
+            if second != now:
+                second, count = now, 0
+            self.window = (second, count + 1)
+            return count >= self.rate_limit
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def answer(self):
+                start = time.time()
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length > 0 else b""
+                body = json.loads(raw) if raw else None
+                if server.latency > 0:
+                    time.sleep(max(server.latency + random.uniform(-server.jitter, server.jitter), 0))
+
+                if server.throttled():
+                    status, out, headers = 429, {"message": "Too many requests"}, {"Retry-After": "1"}
+                else:
+                    status, out, headers = server.handle(self.command, url.path, parse_qs(url.query), body,
+                                                         self.headers)
+                data = b"" if out is None else json.dumps(out).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                server.log.add(self.command, server.route(url.path), status, len(data) + len(raw),
+                               time.time() - start)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = answer
+
+        return Handler
+
+    def handle(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+
+class MockDNAC(MockServer):
+    """
+    DNA Center template programmer: auth, projects, templates (list, details, create, update) and tasks
+    """
+
+    base = "/dna/intent/api/v1/template-programmer"
+
+    def __init__(self, templates, **kwargs):
+        super(MockDNAC, self).__init__(**kwargs)
+        self.data_lock = threading.Lock()
+        self.projects = {}
+        self.templates = {}
+        for (project_name, template_name), content in templates.items():
+            self.add(project_name, template_name, content)
+
+    def add(self, project_name, template_name, content):
+        project_id = self.projects.setdefault(project_name, "p-" + project_name)
+        template_id = "t-{0}-{1}".format(project_name, template_name)
+        self.templates[template_id] = {"name": template_name, "projectName": project_name, "projectId": project_id,
+                                       "templateId": template_id, "templateContent": content,
+                                       "deviceTypes": [{"productFamily": "Switches"}], "softwareType": "IOS-XE",
+                                       "versionsInfo": [{"version": "1"}]}
+
+    def task(self):
+        return 202, {"response": {"taskId": uuid.uuid4().hex}}, {}
+
+    def handle(self, method, path, query, body, headers):
+        with self.data_lock:
+            if path == "/dna/system/api/v1/auth/token":
+                return 200, {"Token": uuid.uuid4().hex}, {}
+            if path == "/dna/intent/api/v1/network-device/count":
+                return 200, {"response": 0}, {}
+            if re.match(r"/dna/intent/api/v1/task/.+$", path):
+                return 200, {"response": {"id": path.rsplit("/", 1)[1], "isError": False, "progress": "done",
+                                          "endTime": int(time.time() * 1000)}}, {}
+            if path == self.base + "/project" and method == "GET":
+                return 200, [{"name": name, "id": project_id} for name, project_id in self.projects.items()], {}
+            if path == self.base + "/project" and method == "POST":
+                self.projects[body["name"]] = "p-" + body["name"]
+                return self.task()
+            if path == self.base + "/template" and method == "GET":
+                project_id = query.get("projectId", [None])[0]
+                fields = ("name", "projectName", "projectId", "templateId", "versionsInfo")
+                return 200, [{field: template[field] for field in fields} for template in self.templates.values()
+                             if project_id is None or template["projectId"] == project_id], {}
+            if path == self.base + "/template" and method == "PUT":
+                template = self.templates[body["id"]]
+                # like DNA Center, an update only changes the draft, a version is only added on commit
+                template["templateContent"] = body["templateContent"]
+                return self.task()
+            match = re.match(self.base + r"/template/(.+)$", path)
+            if match and method == "GET":
+                template = self.templates.get(match.group(1))
+                return (200, template, {}) if template is not None else (404, {}, {})
+            match = re.match(self.base + r"/project/(.+)/template$", path)
+            if match and method == "POST":
+                names = [name for name, project_id in self.projects.items() if project_id == match.group(1)]
+                if len(names) == 0:
+                    return 404, {}, {}
+                self.add(names[0], body["name"], body["templateContent"])
+                return self.task()
+            return 404, {"path": path}, {}
+
+
+class MockGithub(MockServer):
+    """
+    Github repository: contents, git data (refs, trees, blobs, commits), compare and pull requests
+    GETs answer with an ETag and 304 on a matching If-None-Match, every answer carries the X-RateLimit headers,
+    the quota (hourly in Github) is reset every quota_window seconds
+    """
+
+    prefix = "/repos/owner/repo"
+
+    def __init__(self, files, quota=5000, quota_window=3600, **kwargs):
+        super(MockGithub, self).__init__(**kwargs)
+        self.data_lock = threading.Lock()
+        self.quota = quota
+        self.quota_window = quota_window
+        self.quota_reset = time.time() + quota_window
+        self.remaining = quota
+        self.blobs = {}
+        self.trees = {}
+        self.commits = {}
+        self.pulls = 0
+        self.open_pulls = []
+        tree = {}
+        for path, content in files.items():
+            tree[path] = self.add_blob(content)
+        self.refs = {"main": self.new_commit(tree, [])}
+
+    @property
+    def url(self):
+        return super(MockGithub, self).url + self.prefix
+
+    def add_blob(self, content):
+        sha = blob_sha(content)
+        self.blobs[sha] = content
+        return sha
+
+    def new_commit(self, tree, parents):
+        sha = uuid.uuid4().hex
+        self.commits[sha] = {"tree": dict(tree), "parents": parents}
+        return sha
+
+    def encoded(self, sha):
+        return base64.b64encode(self.blobs[sha].encode()).decode()
+
+    def handle(self, method, path, query, body, headers):
+        with self.data_lock:
+            if time.time() > self.quota_reset:
+                self.quota_reset, self.remaining = time.time() + self.quota_window, self.quota
+            limits = {"X-RateLimit-Limit": str(self.quota), "X-RateLimit-Reset": str(int(self.quota_reset))}
+            if self.remaining <= 0:
+                limits["X-RateLimit-Remaining"] = "0"
+                return 403, {"message": "API rate limit exceeded"}, limits
+            self.remaining -= 1
+            limits["X-RateLimit-Remaining"] = str(self.remaining)
+
+            status, out = self.answer(method, path[len(self.prefix):], query, body)
+            if method == "GET" and status == 200:
+                etag = '"{0}"'.format(hashlib.sha1(json.dumps(out, sort_keys=True).encode()).hexdigest())
+                limits["ETag"] = etag
+                if headers.get("If-None-Match") == etag:
+                    # conditional requests do not count against the Github quota
+                    self.remaining += 1
+                    limits["X-RateLimit-Remaining"] = str(self.remaining)
+                    return 304, None, limits
+            return status, out, limits
+
+    def answer(self, method, path, query, body):
+        if path == "":
+            return 200, {"full_name": "owner/repo"}
+        match = re.match(r"/git/refs/heads/(.+)$", path)
+        if match and method == "GET":
+            branch = match.group(1)
+            return (200, {"object": {"sha": self.refs[branch]}}) if branch in self.refs else (404, {})
+        if match and method == "PATCH":
+            self.refs[match.group(1)] = body["sha"]
+            return 200, {"object": {"sha": body["sha"]}}
+        if path == "/git/refs" and method == "POST":
+            branch = body["ref"].split("refs/heads/", 1)[1]
+            if branch in self.refs:
+                return 422, {"message": "Reference already exists"}
+            self.refs[branch] = body["sha"]
+            return 201, {"ref": body["ref"]}
+        match = re.match(r"/git/trees/(.+)$", path)
+        if match and method == "GET":
+            ref = self.refs.get(match.group(1), match.group(1))
+            if ref not in self.commits:
+                return 404, {}
+            return 200, {"sha": ref, "truncated": False,
+                         "tree": [{"path": name, "sha": sha, "type": "blob"}
+                                  for name, sha in self.commits[ref]["tree"].items()]}
+        if path == "/git/trees" and method == "POST":
+            tree = dict(self.trees[body["base_tree"]])
+            for entry in body["tree"]:
+                tree[entry["path"]] = entry["sha"]
+            sha = uuid.uuid4().hex
+            self.trees[sha] = tree
+            return 201, {"sha": sha}
+        match = re.match(r"/git/blobs/(.+)$", path)
+        if match and method == "GET":
+            if match.group(1) not in self.blobs:
+                return 404, {}
+            return 200, {"sha": match.group(1), "content": self.encoded(match.group(1)), "encoding": "base64"}
+        if path == "/git/blobs" and method == "POST":
+            return 201, {"sha": self.add_blob(base64.b64decode(body["content"]).decode())}
+        match = re.match(r"/git/commits/(.+)$", path)
+        if match and method == "GET":
+            commit = self.commits.get(match.group(1))
+            if commit is None:
+                return 404, {}
+            self.trees[match.group(1)] = commit["tree"]
+            return 200, {"sha": match.group(1), "tree": {"sha": match.group(1)}}
+        if path == "/git/commits" and method == "POST":
+            return 201, {"sha": self.new_commit(self.trees[body["tree"]], body["parents"])}
+        match = re.match(r"/compare/(.+)\.\.\.(.+)$", path)
+        if match and method == "GET":
+            if match.group(1) not in self.commits or match.group(2) not in self.commits:
+                return 404, {}
+            base, head = self.commits[match.group(1)]["tree"], self.commits[match.group(2)]["tree"]
+            return 200, {"files": [{"filename": name} for name in set(base) | set(head)
+                                   if base.get(name) != head.get(name)]}
+        match = re.match(r"/contents/(.+)$", path)
+        if match:
+            branch = query.get("ref", [None])[0] or (body or {}).get("branch", "main")
+            tree = self.commits[self.refs[branch]]["tree"]
+            sha = tree.get(match.group(1))
+            if method == "GET":
+                if sha is None:
+                    return 404, {}
+                return 200, {"sha": sha, "path": match.group(1), "content": self.encoded(sha)}
+            if method == "PUT":
+                tree = dict(tree)
+                tree[match.group(1)] = self.add_blob(base64.b64decode(body["content"]).decode())
+                self.refs[branch] = self.new_commit(tree, [self.refs[branch]])
+                return (200 if sha is not None else 201), {"content": {"sha": tree[match.group(1)]}}
+        if path == "/pulls" and method == "GET":
+            # the pull requests stay open, a repeated run reuses the one of its branch
+            head = (query.get("head", [""])[0]).split(":")[-1]
+            return 200, [pull for pull in self.open_pulls if pull["head"]["ref"] == head]
+        if path == "/pulls" and method == "POST":
+            self.pulls += 1
+            self.open_pulls.append({"number": self.pulls, "head": {"ref": body["head"]}, "base": {"ref": body["base"]}})
+            return 201, {"number": self.pulls}
+        return 404, {"path": path}
@@ -0,0 +1,215 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import env_var
+from mock_servers import MockDNAC, MockGithub
+
+OPERATIONS = ["update_database", "sync", "sync_incremental", "update_branch", "push"]
+TEMPLATES_PER_PROJECT = 100
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+def template_content(i, lines):
+    return "\n".join(["hostname switch-{0}".format(i)] +
+                     ["interface GigabitEthernet1/0/{0}\n description port {0}".format(n) for n in range(lines)])
+
+
+def build_inventory(count, lines):
+    """
+    Lab has every template; Github misses 1 in 20 and has a newer content for 1 in 10;
+    Prod misses 1 in 10 and differs for 1 in 7
+    """
+    lab, prod, github = {}, {}, {}
+    for i in range(count):
+        project_name, template_name = "Project{0}".format(i // TEMPLATES_PER_PROJECT), "template{0}".format(i)
+        content = template_content(i, lines)
+        lab[(project_name, template_name)] = content
+        if i % 20 != 0:
+            github["{0}/{1}".format(project_name, template_name)] = content + ("\n!changed" if i % 10 == 1 else "")
+        if i % 10 != 0:
+            prod[(project_name, template_name)] = content + ("\n!prod" if i % 7 == 0 else "")
+    return lab, prod, github
+
+
+def configure(servers, cluster_names, mongo):
+    """
+    Points the app at the mock servers, the settings are read when the clients are built
+    """
+    dnac_clusters = {name: {"url": servers["dnac_" + name].url, "username": "admin", "password": "admin",
+                            "label": name, "sync_concurrency": 4, "push_concurrency": 8}
+                     for name in cluster_names}
+    settings = {"DNAC_CLUSTERS": dnac_clusters, "DNAC_SOURCE_CLUSTER": cluster_names[0],
+                "GITHUB_URL": servers["github"].url, "GITHUB_TOKEN": "token",
+                "Database1": mongo or "mongodb://localhost", "Cluster1": "benchmark", "Collection1": "templates",
+                "JOB_STORE": "memory"}
+    for name, value in settings.items():
+        setattr(env_var, name, value)
+    if mongo is None:
+        import mongomock
+        import models
+        models.MongoClient = mongomock.MongoClient
+
+    import clients
+    import update_database
+    for name, value in settings.items():
+        setattr(clients, name, value)
+        setattr(update_database, name, value)
+    clients.clusters.settings.update(dnac_clusters)
+    clients.db.database.drop_collection("templates")
+    clients.db.database.drop_collection("sync_state")
+    # every inventory starts with cold clients: no token, template index, cached content or database indexes
+    for client in list(clients.registry.values()) + [clients.content_cache, clients.job_store]:
+        client.client = None
+
+
+def run_operation(operation, servers, cluster_names, verbose):
+    import update_database
+    from clients import db
+
+    names = [entry["name"] for entry in db.list_templates(fields=("name",))]
+    calls = {"update_database": lambda: update_database.update_database(),
+             "sync": lambda: update_database.sync_templates(db.list_templates()),
+             "sync_incremental": lambda: update_database.sync_incremental(),
+             "update_branch": lambda: update_database.update_branch(names),
+             "push": lambda: update_database.push_templates(names, cluster_names[1:] or cluster_names)}
+
+    for server in servers.values():
+        server.log.operation = operation
+    output = sys.stdout if verbose else io.StringIO()
+    start = time.time()
+    with contextlib.redirect_stdout(output):
+        calls[operation]()
+    result = {"wall": round(time.time() - start, 3), "backends": {}}
+
+    for backend, server in servers.items():
+        records = server.log.for_operation(operation)
+        latencies = [record[5] * 1000 for record in records]
+        statuses = {}
+        for record in records:
+            statuses[str(record[3])] = statuses.get(str(record[3]), 0) + 1
+        result["backends"][backend] = {"requests": len(records), "bytes": sum(record[4] for record in records),
+                                       "p50": round(percentile(latencies, 50), 1),
+                                       "p99": round(percentile(latencies, 99), 1), "statuses": statuses}
+    return result
+
+
+def run_inventory(count, args):
+    """
+    The first cluster is the source cluster with the Lab inventory, the other clusters get the Prod inventory
+    """
+    lab, prod, github = build_inventory(count, args.lines)
+    limits = {"latency": args.latency, "jitter": args.jitter}
+    servers = {"dnac_" + name: MockDNAC(lab if i == 0 else prod, rate_limit=args.dnac_rate_limit, **limits).start()
+               for i, name in enumerate(args.clusters)}
+    servers["github"] = MockGithub(github, quota=args.github_quota, quota_window=args.github_quota_window,
+                                   rate_limit=args.github_rate_limit, **limits).start()
+    try:
+        configure(servers, args.clusters, args.mongo)
+        return {operation: run_operation(operation, servers, args.clusters, args.verbose)
+                for operation in args.operations}
+    finally:
+        for server in servers.values():
+            server.stop()
+
+
+def report(results):
+    print("{0:>8} {1:<17} {2:>9} {3:<12} {4:>9} {5:>11} {6:>9} {7:>9}  {8}".format(
+        "templates", "operation", "wall (s)", "backend", "requests", "bytes", "p50 (ms)", "p99 (ms)", "statuses"))
+    for count, operations in results.items():
+        for operation, result in operations.items():
+            for backend, stats in result["backends"].items():
+                statuses = ", ".join("{0}: {1}".format(*status) for status in sorted(stats["statuses"].items()))
+                print("{0:>8} {1:<17} {2:>9} {3:<12} {4:>9} {5:>11} {6:>9} {7:>9}  {8}".format(
+                    count, operation, result["wall"], backend, stats["requests"], stats["bytes"], stats["p50"],
+                    stats["p99"], statuses))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions against a previous run: more requests or a wall time above the tolerance
+    """
+    regressions = []
+    for count, operations in results.items():
+        for operation, result in operations.items():
+            previous = baseline.get(count, {}).get(operation)
+            if previous is None:
+                continue
+            if result["wall"] > previous["wall"] * (1 + tolerance):
+                regressions.append("{0} templates, {1}: wall time {2}s, was {3}s".format(
+                    count, operation, result["wall"], previous["wall"]))
+            for backend, stats in result["backends"].items():
+                before = previous["backends"].get(backend, {}).get("requests", 0)
+                if stats["requests"] > before:
+                    regressions.append("{0} templates, {1}: {2} {3} requests, was {4}".format(
+                        count, operation, stats["requests"], backend, before))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the template operations against local mock backends")
+    parser.add_argument("--templates", default="10,100,1000", help="inventory sizes, comma separated")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="operations to run, in order")
+    parser.add_argument("--clusters", default="lab,prod", help="DNA Center clusters, the first one is the source")
+    parser.add_argument("--lines", type=int, default=20, help="interfaces per template content")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds added to the latency")
+    parser.add_argument("--dnac-rate-limit", type=int, default=None, help="DNA Center requests per second")
+    parser.add_argument("--github-rate-limit", type=int, default=None, help="Github requests per second")
+    parser.add_argument("--github-quota", type=int, default=5000, help="Github requests per quota window")
+    parser.add_argument("--github-quota-window", type=int, default=3600, help="seconds of a Github quota window")
+    parser.add_argument("--mongo", default=None, help="Mongo connection string, mongomock is used by default")
+    parser.add_argument("--output", default=None, help="writes the results as json")
+    parser.add_argument("--baseline", default=None, help="results json of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed wall time increase over the baseline")
+    parser.add_argument("--verbose", action="store_true", help="shows the output of the operations")
+    args = parser.parse_args()
+    args.operations = [operation for operation in args.operations.split(",") if operation in OPERATIONS]
+    args.clusters = args.clusters.split(",")
+
+    results = {}
+    for count in [int(count) for count in args.templates.split(",")]:
+        results[str(count)] = run_inventory(count, args)
+    report(results)
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
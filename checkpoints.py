@@ -0,0 +1,75 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import hashlib
+import json
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+
+def operation_id(action, **params):
+    """
+    Id of a bulk operation: the same action with the same parameters resumes the checkpoints of the previous run
+    """
+    return "{0}-{1}".format(action, hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16])
+
+
+def resumed(completed, key, source_hash):
+    # a template is only skipped if it was done with the same source content
+    checkpoint = completed.get(key)
+    return checkpoint is not None and source_hash is not None and checkpoint.get("hash") == source_hash
+
+
+class Checkpoints(object):
+    """
+    Per template progress of a bulk operation, kept in MongoDB under the operation id so a run that failed
+    part way can be resumed: the templates marked done are skipped while their source content hash is unchanged,
+    the failed ones are retried
+    The checkpoints are cleared once a run completes without failures, and expire after ttl seconds
+    """
+
+    def __init__(self, collection, operation_id, ttl=7 * 24 * 3600):
+        self.collection = collection
+        self.operation_id = operation_id
+        self.collection.create_index([("operationId", 1), ("key", 1)], unique=True)
+        self.collection.create_index("updateTime", expireAfterSeconds=ttl)
+
+    def completed(self):
+        # {key: {"result", "hash"}} of the templates done by the previous runs of the operation
+        cursor = self.collection.find({"operationId": self.operation_id, "status": "done"},
+                                      {"key": 1, "result": 1, "hash": 1})
+        return {checkpoint["key"]: checkpoint for checkpoint in cursor}
+
+    def done(self, hashes, result="done"):
+        # hashes is {key: hash of the source content the key was done with}
+        operations = [self.__update(key, {"status": "done", "result": result, "hash": source_hash, "error": None})
+                      for key, source_hash in hashes.items()]
+        self.__write(operations)
+
+    def fail(self, errors):
+        # errors is {key: error}
+        self.__write([self.__update(key, {"status": "failed", "error": str(error)}) for key, error in errors.items()])
+
+    def clear(self):
+        self.collection.delete_many({"operationId": self.operation_id})
+
+    def __update(self, key, new_value):
+        return UpdateOne({"operationId": self.operation_id, "key": key},
+                         {"$set": dict(new_value, updateTime=datetime.utcnow())}, upsert=True)
+
+    def __write(self, operations):
+        if len(operations) > 0:
+            self.collection.bulk_write(operations, ordered=False)
@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from env_var import *
+
+from content_cache import ContentCache
+from jobs import MemoryJobStore, MongoJobStore
+from metrics import bind
+from models import DNACenter, LocalDatabase, Github
+from rate_limit import RateLimitScheduler
+
+registry = {}
+
+
+class LazyClient(object):
+    """
+    Builds the client on first use and shares it process wide, importing a module never connects to a backend
+    probe(client) is a cheap call used by the health check
+    """
+
+    def __init__(self, name, factory, probe=None):
+        self.name = name
+        self.factory = factory
+        self.probe = probe
+        self.client = None
+        self.lock = threading.Lock()
+
+    def instance(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = self.factory()
+        return self.client
+
+    def __getattr__(self, attr):
+        return getattr(self.instance(), attr)
+
+    def check(self):
+        start = time.time()
+        try:
+            if self.probe is not None:
+                self.probe(self.instance())
+            else:
+                self.instance()
+            return {"status": "up", "latency": round((time.time() - start) * 1000, 1)}
+        except Exception as e:
+            return {"status": "down", "latency": round((time.time() - start) * 1000, 1), "error": repr(e)}
+
+
+def register(name, factory, probe=None):
+    client = LazyClient(name, factory, probe)
+    registry[name] = client
+    return client
+
+
+def health(timeout=5):
+    """
+    Probes all the registered backends in parallel, a backend that does not answer within timeout is reported down
+    """
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max(len(registry), 1))
+    checks = {name: executor.submit(client.check) for name, client in registry.items()}
+    for name, check in checks.items():
+        try:
+            results[name] = check.result(timeout=timeout)
+        except TimeoutError:
+            results[name] = {"status": "down", "error": "No answer after {0} seconds".format(timeout)}
+        results[name]["connected"] = registry[name].client is not None
+    executor.shutdown(wait=False)
+    return results
+
+
+class ClusterRegistry(object):
+    """
+    The DNA Center clusters by name: every cluster has its own lazily built client (connection pool, token,
+    template index) and its own sync and push concurrency limits
+    settings: {name: {"url", "username", "password", "label", "sync_concurrency", "push_concurrency", "pool_size"}}
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.clients = {name: register("dnac_" + name, self.__factory(name), probe=lambda dnac: dnac.ping())
+                        for name in settings}
+
+    def __factory(self, name):
+        # the settings are read when the client is built
+        def create():
+            cluster = self.settings[name]
+            return DNACenter(username=cluster["username"], password=cluster["password"], base_url=cluster["url"],
+                             name=name, pool_size=cluster.get("pool_size", HTTP_POOL_SIZE), cache=content_cache)
+        return create
+
+    def __getitem__(self, name):
+        return self.clients[name]
+
+    def __contains__(self, name):
+        return name in self.clients
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def items(self):
+        return self.clients.items()
+
+    def label(self, name):
+        return self.settings[name].get("label", name)
+
+    def limits(self, kind, names=None):
+        # {cluster: concurrency} for kind "sync" or "push", for BoundedExecutor
+        return {name: self.settings[name].get(kind + "_concurrency", 4) for name in (names or self.clients)}
+
+    def refresh_indexes(self, names=None):
+        # rebuilds the template index of the clusters in parallel
+        names = list(names or self.clients)
+        with ThreadPoolExecutor(max_workers=max(len(names), 1)) as executor:
+            list(executor.map(bind(lambda name: self.clients[name].refresh_index()), names))
+
+    def reload_listings(self, project_names, names=None):
+        # lists the given projects again in the clusters in parallel, without dropping the rest of the indexes
+        names = list(names or self.clients)
+        with ThreadPoolExecutor(max_workers=max(len(names), 1)) as executor:
+            list(executor.map(bind(lambda name: self.clients[name].reload_listings(project_names)), names))
+
+
+def create_content_cache():
+    collection = db.database[CACHE_COLLECTION] if CACHE_PERSIST else None
+    return ContentCache(max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, collection=collection)
+
+
+def create_job_store():
+    if JOB_STORE == "mongo":
+        return MongoJobStore(db.database[JOB_COLLECTION])
+    return MemoryJobStore()
+
+
+content_cache = LazyClient("cache", create_content_cache)
+clusters = ClusterRegistry(DNAC_CLUSTERS)
+db = register("mongo", lambda: LocalDatabase(cluster=Cluster1, database=Database1, collection=Collection1,
+                                             batch_size=DB_BATCH_SIZE, clusters=list(DNAC_CLUSTERS)),
+              probe=lambda database: database.cluster.admin.command("ping"))
+github = register("github", lambda: Github(base_url=GITHUB_URL, token=GITHUB_TOKEN, pool_size=HTTP_POOL_SIZE,
+                                           cache=content_cache,
+                                           scheduler=RateLimitScheduler(rate=GITHUB_RATE, burst=GITHUB_BURST,
+                                                                        etag_cache_bytes=GITHUB_ETAG_CACHE_BYTES)),
+                  probe=lambda client: client.ping())
+job_store = LazyClient("jobs", create_job_store)
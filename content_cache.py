@@ -0,0 +1,100 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+class ContentCache(object):
+    """
+    LRU cache of template contents with a time to live and a memory cap, shared by the Github and DNACenter clients
+    Keys are (backend, project name, template name, version or sha), so a new version is a cache miss by itself
+    If a collection is given, entries are also written to MongoDB so a restarted app starts warm
+    The memory cap counts the utf-8 encoded size of the contents, the versions cached for each template are indexed
+    so a write only drops the entries of its template
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, collection=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.collection = collection
+        self.entries = OrderedDict()
+        self.templates = {}  # (backend, project name, template name) -> keys of the cached versions
+        self.size = 0
+        self.lock = threading.Lock()
+        if self.collection is not None:
+            self.collection.create_index("expireAt", expireAfterSeconds=0)
+            self.collection.create_index([("backend", 1), ("project", 1), ("template", 1)])
+
+    @staticmethod
+    def __id(key):
+        return "/".join(str(part) for part in key)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                content, expires, size = entry
+                if expires > time.time():
+                    self.entries.move_to_end(key)
+                    return content
+                self.__remove(key)
+        if self.collection is not None:
+            document = self.collection.find_one({"_id": self.__id(key), "expireAt": {"$gt": datetime.utcnow()}})
+            if document is not None:
+                self.__store(key, document["content"])
+                return document["content"]
+        return None
+
+    def put(self, key, content):
+        self.__store(key, content)
+        if self.collection is not None:
+            backend, project_name, template_name, version = key
+            self.collection.replace_one({"_id": self.__id(key)},
+                                        {"backend": backend, "project": project_name, "template": template_name,
+                                         "version": version, "content": content,
+                                         "expireAt": datetime.utcnow() + timedelta(seconds=self.ttl)},
+                                        upsert=True)
+
+    def invalidate(self, backend, project_name, template_name):
+        # Drops every version of the template, called when the application writes it
+        with self.lock:
+            for key in list(self.templates.get((backend, project_name, template_name), ())):
+                self.__remove(key)
+        if self.collection is not None:
+            self.collection.delete_many({"backend": backend, "project": project_name, "template": template_name})
+
+    def __store(self, key, content):
+        size = len(content.encode())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+            self.entries[key] = (content, time.time() + self.ttl, size)
+            self.templates.setdefault(key[:3], set()).add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.__remove(next(iter(self.entries)))
+
+    def __remove(self, key):
+        content, expires, size = self.entries.pop(key)
+        self.size -= size
+        versions = self.templates[key[:3]]
+        versions.discard(key)
+        if len(versions) == 0:
+            del self.templates[key[:3]]
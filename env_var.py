@@ -3,6 +3,11 @@ DNAC_URL = " "
 DNAC_USER = " "
 DNAC_PASS = " "
 
+#DNA Center Prod Credentials
+DNAC_URL_PROD = " "
+DNAC_USER_PROD = " "
+DNAC_PASS_PROD = " "
+
 #Github Token
 GITHUB_TOKEN = " "
 GITHUB_URL = " "
@@ -15,3 +20,75 @@ WEBEX_ACCESS_TOKEN = " "
 Database = " "
 Cluster = " "
 Collection = " "
+
+#Sync concurrency: Github worker threads (the DNA Center limits are set per cluster in DNAC_CLUSTERS)
+SYNC_CONCURRENCY = {"github": 8}
+
+#DNA Center clusters: templates are synced with and pushed to all of them, their status is kept per cluster
+#label shown in the GUI, templates synced and pushed at the same time, and HTTP connection pool size per cluster
+DNAC_CLUSTERS = {
+    "lab": {"url": DNAC_URL, "username": DNAC_USER, "password": DNAC_PASS, "label": "DNA Center Lab",
+            "sync_concurrency": 4, "push_concurrency": 8, "pool_size": 10},
+    "prod": {"url": DNAC_URL_PROD, "username": DNAC_USER_PROD, "password": DNAC_PASS_PROD,
+             "label": "DNA Center Production", "sync_concurrency": 4, "push_concurrency": 8, "pool_size": 10},
+}
+
+#Cluster the database is filled from (Update Database) and the Github development branch is updated from
+DNAC_SOURCE_CLUSTER = "lab"
+
+#HTTP connection pool size per client (keep at least as large as the sync concurrency)
+HTTP_POOL_SIZE = 10
+
+#Background jobs: "mongo" keeps the job queue in the database, "memory" in the app process
+JOB_STORE = "mongo"
+JOB_COLLECTION = "jobs"
+JOB_WORKERS = 2
+
+#Seconds between the heartbeats of a running job, and without heartbeat before it is failed as interrupted
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_HEARTBEAT_TIMEOUT = 300
+
+#Number of templates written to the database per bulk write
+DB_BATCH_SIZE = 500
+
+#Main page: templates per page by default and at most
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+#DNA Center task tracking: tasks polled per round (rotating through the pushed templates) and seconds to wait for them
+TASK_POLL_BATCH = 10
+TASK_TIMEOUT = 300
+
+#Seconds the /health endpoint waits for each backend
+HEALTH_TIMEOUT = 5
+
+#Template content cache: memory cap in bytes, seconds an entry stays valid, and whether it is persisted in the database
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = 3600
+CACHE_PERSIST = False
+CACHE_COLLECTION = "content_cache"
+
+#Github request pacing: requests per second and burst size, and bytes of responses kept for conditional requests
+GITHUB_RATE = 10
+GITHUB_BURST = 20
+GITHUB_ETAG_CACHE_BYTES = 16 * 1024 * 1024
+
+#Seconds between full syncs, the syncs in between only check the templates that changed
+FULL_SYNC_INTERVAL = 7 * 24 * 3600
+
+#Template comparison: regular expressions of the lines ignored when comparing and diffing content
+#(e.g. headers added by DNA Center), and the number of diffs kept in memory
+DIFF_IGNORE_PATTERNS = []
+DIFF_CACHE_SIZE = 256
+
+#Change watcher: Github push webhook secret, seconds without changes before the changed templates are synced,
+#seconds a change waits at most, and seconds between two polls of the DNA Center template versions
+WATCH_CHANGES = True
+GITHUB_WEBHOOK_SECRET = " "
+WATCH_DEBOUNCE = 10
+WATCH_MAX_DELAY = 60
+DNAC_POLL_INTERVAL = 300
+
+#Resumable bulk operations (push, update branch): collection of the per template checkpoints and seconds they are kept
+CHECKPOINT_COLLECTION = "checkpoints"
+CHECKPOINT_TTL = 7 * 24 * 3600
@@ -0,0 +1,301 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from checkpoints import operation_id
+from metrics import JobSummary, operation
+
+
+class MemoryJobStore(object):
+    """
+    Keeps the jobs in the process memory, jobs are lost on restart
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def add(self, job, stale_before=None):
+        # Returns the active job with the same key instead of adding a duplicate
+        with self.lock:
+            if stale_before is not None:
+                self.__recover(stale_before)
+            for existing in self.jobs.values():
+                if existing.get("activeKey") == job["activeKey"]:
+                    return dict(existing)
+            self.jobs[job["_id"]] = job
+            return dict(job)
+
+    def claim_next(self, worker_id, stale_before=None):
+        with self.lock:
+            if stale_before is not None:
+                self.__recover(stale_before)
+            queued = [job for job in self.jobs.values() if job["status"] == "queued"]
+            if len(queued) == 0:
+                return None
+            job = min(queued, key=lambda k: k["createTime"])
+            now = time.time()
+            job.update({"status": "running", "startTime": now, "workerId": worker_id, "heartbeat": now})
+            return dict(job)
+
+    def recover(self, stale_before):
+        with self.lock:
+            return self.__recover(stale_before)
+
+    def heartbeat(self, job_ids):
+        with self.lock:
+            for job_id in job_ids:
+                if job_id in self.jobs:
+                    self.jobs[job_id]["heartbeat"] = time.time()
+
+    def __recover(self, stale_before):
+        stale = [job for job in self.jobs.values() if job["status"] == "running" and
+                 job.get("heartbeat", job.get("startTime", 0)) < stale_before]
+        for job in stale:
+            job.update(STALE_JOB)
+            job.pop("activeKey", None)
+        return len(stale)
+
+    def update(self, job_id, new_value):
+        with self.lock:
+            self.jobs[job_id].update(new_value)
+
+    def finish(self, job_id, new_value):
+        with self.lock:
+            self.jobs[job_id].update(new_value)
+            self.jobs[job_id].pop("activeKey", None)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def list(self, limit=20):
+        with self.lock:
+            jobs = sorted(self.jobs.values(), key=lambda k: k["createTime"], reverse=True)
+            return [dict(job) for job in jobs[:limit]]
+
+
+# a running job whose worker stopped refreshing its heartbeat (crash, redeploy) is failed, so it can be started again
+STALE_JOB = {"status": "failed", "message": "The job was interrupted, please run it again"}
+
+
+class MongoJobStore(object):
+    """
+    Keeps the jobs in a MongoDB collection, so they survive restarts and are shared between the app processes
+    A unique sparse index on activeKey deduplicates queued/running jobs across processes
+    Running jobs carry the workerId and heartbeat of the worker running them, stale ones are failed and released
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index("activeKey", unique=True, sparse=True)
+        self.collection.create_index([("status", 1), ("createTime", 1)])
+
+    def add(self, job, stale_before=None):
+        if stale_before is not None:
+            self.recover(stale_before)
+        try:
+            self.collection.insert_one(job)
+            return job
+        except DuplicateKeyError:
+            existing = self.collection.find_one({"activeKey": job["activeKey"]})
+            if existing is None:
+                # the active job finished in the meantime
+                return self.add(job)
+            return existing
+
+    def claim_next(self, worker_id, stale_before=None):
+        if stale_before is not None:
+            self.recover(stale_before)
+        now = time.time()
+        return self.collection.find_one_and_update({"status": "queued"},
+                                                   {"$set": {"status": "running", "startTime": now,
+                                                             "workerId": worker_id, "heartbeat": now}},
+                                                   sort=[("createTime", 1)], return_document=ReturnDocument.AFTER)
+
+    def recover(self, stale_before):
+        # the jobs started before the heartbeat was recorded are judged by their start time
+        stale = {"status": "running", "$or": [{"heartbeat": {"$lt": stale_before}},
+                                              {"heartbeat": {"$exists": False}, "startTime": {"$lt": stale_before}}]}
+        result = self.collection.update_many(stale, {"$set": dict(STALE_JOB, endTime=time.time()),
+                                                     "$unset": {"activeKey": ""}})
+        return result.modified_count
+
+    def heartbeat(self, job_ids):
+        self.collection.update_many({"_id": {"$in": list(job_ids)}, "status": "running"},
+                                    {"$set": {"heartbeat": time.time()}})
+
+    def update(self, job_id, new_value):
+        self.collection.update_one({"_id": job_id}, {"$set": new_value})
+
+    def finish(self, job_id, new_value):
+        self.collection.update_one({"_id": job_id}, {"$set": new_value, "$unset": {"activeKey": ""}})
+
+    def get(self, job_id):
+        return self.collection.find_one({"_id": job_id})
+
+    def list(self, limit=20):
+        return list(self.collection.find().sort("createTime", -1).limit(limit))
+
+
+class JobManager(object):
+    """
+    Runs the registered actions on an in-process worker pool, jobs are queued in a pluggable store
+    Enqueueing an action with the same parameters as a queued/running job returns that job instead
+    The running jobs are kept alive by a heartbeat every heartbeat_interval seconds, a job without heartbeat for
+    heartbeat_timeout seconds (its worker crashed or was redeployed) is failed so the action can be enqueued again
+    """
+
+    def __init__(self, store, workers=2, poll_interval=1, progress_interval=1, heartbeat_interval=30,
+                 heartbeat_timeout=300):
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.worker_id = "{0}-{1}-{2}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.actions = {}
+        self.__running = set()
+        self.__wakeup = threading.Event()
+        self.__lock = threading.Lock()
+        self.__threads = []
+
+    def register(self, action, func):
+        # func is called with the job parameters and a progress(done, total) callback, returns the job message
+        self.actions[action] = func
+
+    def start(self):
+        with self.__lock:
+            if len(self.__threads) > 0:
+                return
+            try:
+                self.store.recover(self.__stale_before())
+            except Exception as e:
+                print("Could not recover the interrupted jobs: {0!r}".format(e))
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.__work, name="job-worker-{0}".format(i), daemon=True)
+                thread.start()
+                self.__threads.append(thread)
+            thread = threading.Thread(target=self.__heartbeat, name="job-heartbeat", daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def enqueue(self, action, params):
+        job = {"_id": uuid.uuid4().hex,
+               "action": action,
+               "params": params,
+               # a hash of the canonical parameters, a large selection stays within the index key size
+               "activeKey": operation_id(action, **params),
+               "status": "queued",
+               "progress": None,
+               "message": None,
+               "createTime": time.time(),
+               "createDate": datetime.now().strftime('%H:%M %m-%d-%Y')}
+        job = self.store.add(job, self.__stale_before())
+        self.__wakeup.set()
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def list(self, limit=20):
+        return self.store.list(limit)
+
+    def __work(self):
+        while True:
+            try:
+                job = self.store.claim_next(self.worker_id, self.__stale_before())
+            except Exception as e:
+                # the store is not reachable (yet), try again later
+                print("Could not claim a job: {0!r}".format(e))
+                time.sleep(self.poll_interval)
+                continue
+            if job is None:
+                self.__wakeup.wait(self.poll_interval)
+                self.__wakeup.clear()
+                continue
+            with self.__lock:
+                self.__running.add(job["_id"])
+            try:
+                self.__run(job)
+            except Exception as e:
+                # the worker keeps claiming jobs whatever happened to this one
+                print("Job {0} could not be run: {1!r}".format(job["_id"], e))
+            finally:
+                with self.__lock:
+                    self.__running.discard(job["_id"])
+
+    def __stale_before(self):
+        return time.time() - self.heartbeat_timeout
+
+    def __heartbeat(self):
+        # the jobs are also kept alive while an action runs for long without reporting progress
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self.__lock:
+                running = list(self.__running)
+            if len(running) == 0:
+                continue
+            try:
+                self.store.heartbeat(running)
+            except Exception as e:
+                print("Could not refresh the job heartbeat: {0!r}".format(e))
+
+    def __run(self, job):
+        last_update = [0]
+
+        def progress(done, total):
+            # progress is written at most every progress_interval seconds, and always for the last template
+            now = time.time()
+            if done == total or now - last_update[0] >= self.progress_interval:
+                last_update[0] = now
+                try:
+                    self.store.update(job["_id"], {"progress": {"done": done, "total": total}, "heartbeat": now})
+                except Exception as e:
+                    # a missed progress update does not fail the action
+                    print("Could not update the progress of job {0}: {1!r}".format(job["_id"], e))
+
+        # the backend calls of the job are recorded under its action and summed up in the job
+        summary = JobSummary()
+        try:
+            with operation(job["action"], summary):
+                message = self.actions[job["action"]](progress=progress, **job["params"])
+            result = {"status": "done", "message": message}
+        except Exception as e:
+            print("Job {0} failed: {1!r}".format(job["_id"], e))
+            result = {"status": "failed", "message": "Please contact IT team"}
+        self.__finish(job["_id"], dict(result, endTime=time.time(), metrics=summary.to_dict()))
+
+    def __finish(self, job_id, new_value, attempts=3):
+        # the result is retried while the store is unreachable, a job that still cannot be finished stops getting
+        # heartbeats and is failed as interrupted later on
+        for attempt in range(attempts):
+            try:
+                self.store.finish(job_id, new_value)
+                return
+            except Exception as e:
+                print("Could not finish job {0}: {1!r}".format(job_id, e))
+                time.sleep(self.poll_interval)
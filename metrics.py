@@ -0,0 +1,204 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import contextvars
+import re
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import bson
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# (operation, job summary) of the running code, handed to the worker threads by bind
+_scope = contextvars.ContextVar("metrics_scope", default=("none", None))
+
+
+class JobSummary(object):
+    """
+    Totals per backend of the calls made by one job: requests, errors, bytes and seconds
+    """
+
+    def __init__(self):
+        self.backends = {}
+        self.lock = threading.Lock()
+
+    def add(self, backend, status, size, seconds):
+        with self.lock:
+            totals = self.backends.setdefault(backend, {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0})
+            totals["requests"] += 1
+            totals["errors"] += 1 if not str(status).startswith(("2", "3", "ok")) else 0
+            totals["bytes"] += size
+            totals["seconds"] += seconds
+
+    def to_dict(self):
+        with self.lock:
+            return {backend: dict(totals, seconds=round(totals["seconds"], 3))
+                    for backend, totals in self.backends.items()}
+
+
+class Metrics(object):
+    """
+    Call counts, bytes, status codes and latency histograms per backend, endpoint and operation
+    render() returns them in the Prometheus text format
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.requests = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, backend, endpoint, status, size, seconds):
+        operation, summary = _scope.get()
+        with self.lock:
+            key = (backend, endpoint, operation, str(status))
+            count, total = self.requests.get(key, (0, 0))
+            self.requests[key] = (count + 1, total + size)
+
+            key = (backend, endpoint, operation)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bucket in enumerate(self.buckets):
+                if seconds <= bucket:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+        if summary is not None:
+            summary.add(backend, status, size, seconds)
+
+    def render(self):
+        def labels(backend, endpoint, operation, **extra):
+            values = [("backend", backend), ("endpoint", endpoint), ("operation", operation)] + sorted(extra.items())
+            return ",".join('{0}="{1}"'.format(name, str(value).replace('"', '\\"')) for name, value in values)
+
+        with self.lock:
+            requests = sorted(self.requests.items())
+            histograms = sorted((key, (list(buckets), count, total)) for key, (buckets, count, total)
+                                in self.histograms.items())
+
+        lines = ["# HELP backend_requests_total Requests made to the backends",
+                 "# TYPE backend_requests_total counter"]
+        for (backend, endpoint, operation, status), (count, size) in requests:
+            lines.append("backend_requests_total{{{0}}} {1}".format(labels(backend, endpoint, operation,
+                                                                           status=status), count))
+        lines += ["# HELP backend_response_bytes_total Bytes received from the backends",
+                  "# TYPE backend_response_bytes_total counter"]
+        for (backend, endpoint, operation, status), (count, size) in requests:
+            lines.append("backend_response_bytes_total{{{0}}} {1}".format(labels(backend, endpoint, operation,
+                                                                                 status=status), size))
+        lines += ["# HELP backend_request_duration_seconds Latency of the backend requests",
+                  "# TYPE backend_request_duration_seconds histogram"]
+        for (backend, endpoint, operation), (buckets, count, total) in histograms:
+            for bucket, bucket_count in zip(self.buckets, buckets):
+                lines.append("backend_request_duration_seconds_bucket{{{0}}} {1}".format(
+                    labels(backend, endpoint, operation, le=bucket), bucket_count))
+            lines.append("backend_request_duration_seconds_bucket{{{0}}} {1}".format(
+                labels(backend, endpoint, operation, le="+Inf"), count))
+            lines.append("backend_request_duration_seconds_sum{{{0}}} {1}".format(
+                labels(backend, endpoint, operation), round(total, 6)))
+            lines.append("backend_request_duration_seconds_count{{{0}}} {1}".format(
+                labels(backend, endpoint, operation), count))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def operation(name, summary=None):
+    # The calls made inside the block, and in the functions it hands to threads with bind, are recorded under name
+    token = _scope.set((name, summary))
+    try:
+        yield summary
+    finally:
+        _scope.reset(token)
+
+
+def bind(func):
+    """
+    Returns func running under the operation of the caller, to be handed to worker threads (executor.submit/map)
+    """
+    scope = _scope.get()
+
+    def run(*args, **kwargs):
+        token = _scope.set(scope)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _scope.reset(token)
+
+    return run
+
+
+def endpoint(path):
+    # Groups the urls by endpoint: template paths, ids and shas are replaced by placeholders
+    path = re.sub(r"/contents/.*", "/contents/{path}", path)
+    path = re.sub(r"/compare/.*", "/compare/{range}", path)
+    return re.sub(r"/[0-9a-fA-F-]{20,}(?=/|$)", "/{id}", path)
+
+
+def response_hook(backend, base_url):
+    """
+    Returns a requests response hook recording every response of a session under backend
+    """
+    prefix = urlparse(base_url).path.rstrip("/")
+
+    def hook(r, *args, **kwargs):
+        path = urlparse(r.url).path
+        if path.startswith(prefix):
+            path = path[len(prefix):] or "/"
+        metrics.record(backend, "{0} {1}".format(r.request.method, endpoint(path)), r.status_code,
+                       len(r.content or b""), r.elapsed.total_seconds())
+
+    return hook
+
+
+class MongoListener(monitoring.CommandListener):
+    """
+    Records the MongoDB commands (find, update, insert...) of a client under the mongo backend, the bytes are the
+    BSON size of the command reply
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            command = "{0} {1}".format(event.command_name, collection)
+        else:
+            command = event.command_name
+        with self.lock:
+            self.commands[event.request_id] = command
+
+    def __finish(self, event, status, reply):
+        with self.lock:
+            command = self.commands.pop(event.request_id, event.command_name)
+        try:
+            size = len(bson.encode(reply))
+        except Exception:
+            size = 0
+        metrics.record("mongo", command, status, size, event.duration_micros / 1000000.0)
+
+    def succeeded(self, event):
+        self.__finish(event, "ok", event.reply)
+
+    def failed(self, event):
+        self.__finish(event, "failed", event.failure)
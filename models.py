@@ -13,64 +13,231 @@ or implied.
 """
 
 import base64
+import hashlib
 import json
+from http import cookiejar
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
 import urllib3
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+from checkpoints import Checkpoints
+from metrics import MongoListener, bind, response_hook
+from rate_limit import RateLimitScheduler
+from task_tracker import TaskTracker
+
+
+class _NoCookiePolicy(cookiejar.DefaultCookiePolicy):
+    # The APIs authenticate with headers only, so the shared session never stores cookies between threads
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def create_session(pool_size=10, retries=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)):
+    """
+    Returns a keep-alive session with a connection pool of pool_size and retries with exponential backoff
+    on the status_forcelist answers (throttling and server errors). The pool is thread safe, so one session is
+    shared by all worker threads
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=status_forcelist,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookiePolicy())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def git_blob_sha(content):
+    """
+    Hashes the content the way git hashes a blob, so DNA Center content compares directly with Github blob shas
+    """
+    data = content.encode()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def cluster_field(cluster, field):
+    # Path of a per cluster field (status, version, hash) of a template entry
+    return "clusters.{0}.{1}".format(cluster, field)
+
+
+# Fixed Lab/Prod fields of the databases created before the per cluster status map
+LEGACY_STATUS_FIELDS = {"lab": {"inLab": "status", "labVersion": "version", "labHash": "hash"},
+                        "prod": {"inProd": "status", "prodVersion": "version", "prodHash": "hash"}}
 
 
 class Github(object):
 
-    def __init__(self, token, base_url):
+    def __init__(self, token, base_url, pool_size=10, retries=3, backoff_factor=0.5, cache=None, scheduler=None):
         self.token = token
         self.base_url = base_url
+        # rate limited answers are retried by the scheduler, so every thread waits for them, not by the session
+        self.session = create_session(pool_size, retries, backoff_factor, status_forcelist=(500, 502, 503, 504))
+        self.session.hooks["response"].append(response_hook("github", base_url))
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache  # optional ContentCache
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
     def __github_headers(self):
         return {'Authorization': 'Bearer {0}'.format(self.token), 'Content-Type': 'application/json'}
 
-    def __create_file(self, url, data):
-        r = requests.put(url, headers=self.__github_headers(),
-                         json={"message": "Create file from flask app",
-                               "content": base64.b64encode(data.encode()).decode(),
-                               "branch": "development"})
-        if r.status_code == 201:
-            return r.json()
+    def __request(self, method, url, **kwargs):
+        return self.scheduler.request(self.session, method, url, self.__github_headers(), **kwargs)
+
+    def throttle_stats(self):
+        return self.scheduler.throttle_stats()
+
+    def __invalidate(self, project_name, template_name):
+        if self.cache is not None:
+            self.cache.invalidate("github", project_name, template_name)
+
+    def ping(self):
+        r = self.__request("GET", self.base_url)
+        if r.status_code != 200:
+            raise Exception(r.status_code)
+
+    def get_branch_head(self, branch="main"):
+        url = "{0}/git/refs/heads/{1}".format(self.base_url, branch)
+        r = self.__request("GET", url)
+        if r.status_code == 200:
+            return r.json()["object"]["sha"]
         else:
             raise Exception(r.status_code)
 
-    def get_github_file_content(self, project_name, template_name):
-        url = "{0}/contents/{1}/{2}".format(self.base_url, project_name, template_name)
-        r = requests.get(url, headers=self.__github_headers())
+    def get_changed_files(self, base, head):
+        """
+        Returns the paths changed between the two commits with the compare api, including the old path of renamed
+        files, or None if Github does not list all of them (more than 300 files)
+        """
+        url = "{0}/compare/{1}...{2}".format(self.base_url, base, head)
+        r = self.__request("GET", url)
+        if r.status_code == 404:
+            # the base commit does not exist anymore (force push)
+            return None
+        if r.status_code != 200:
+            raise Exception(r.status_code)
+        files = r.json().get("files", [])
+        if len(files) >= 300:
+            return None
+        paths = set()
+        for changed in files:
+            paths.add(changed["filename"])
+            if changed.get("previous_filename"):
+                paths.add(changed["previous_filename"])
+        return paths
+
+    def get_branch_tree(self, branch="main"):
+        """
+        Returns the path -> blob sha map of the branch, resolved with a single recursive tree request
+        """
+        url = "{0}/git/trees/{1}?recursive=1".format(self.base_url, branch)
+        r = self.__request("GET", url)
+        if r.status_code == 200:
+            tree = r.json()
+            blobs = {item["path"]: item["sha"] for item in tree["tree"] if item["type"] == "blob"}
+            return blobs, tree.get("truncated", False)
+        else:
+            raise Exception(r.status_code)
+
+    def get_blob_content(self, sha):
+        url = "{0}/git/blobs/{1}".format(self.base_url, sha)
+        r = self.__request("GET", url)
         if r.status_code == 200:
-            encoded_content = r.json()["content"]
-            content = base64.b64decode(encoded_content).decode()
-            return content
+            return base64.b64decode(r.json()["content"]).decode()
         else:
             raise Exception(r.status_code)
 
-    def add_template_github(self, template_content, template_name, project_name):
-        data = template_content
-        url = "{0}/contents/{1}/{2}".format(self.base_url, project_name, template_name)
-        r = requests.get(url, headers=self.__github_headers())
+    def get_shas(self, project_template_pairs, branch="main"):
+        """
+        Returns {(project_name, template_name): blob sha} from a single tree request, sha is None if the template
+        is not in Github
+        """
+        blobs, truncated = self.get_branch_tree(branch)
+        shas = {}
+        for project_name, template_name in project_template_pairs:
+            sha = blobs.get("{0}/{1}".format(project_name, template_name))
+            if sha is None and truncated:
+                # the tree listing was cut off by Github, fall back to the contents api for this template
+                entry = self.__get_file_entry(project_name, template_name, branch)
+                sha = None if entry is None else entry["sha"]
+            shas[(project_name, template_name)] = sha
+        return shas
+
+    def get_many(self, project_template_pairs, branch="main", max_workers=8, errors=None):
+        """
+        Returns the content of many templates: the branch tree is resolved once and only the blobs of the
+        requested templates are downloaded, max_workers at a time
+        Returns {(project_name, template_name): content}, content is None if the template is not in Github
+        If an errors dict is given, a failed download is recorded in it and left out of the result instead of raising
+        """
+        blobs, truncated = self.get_branch_tree(branch)
+        contents = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetches = {}
+            for project_name, template_name in project_template_pairs:
+                sha = blobs.get("{0}/{1}".format(project_name, template_name))
+                cached = None if sha is None or self.cache is None else self.cache.get(
+                    ("github", project_name, template_name, sha))
+                if cached is not None:
+                    contents[(project_name, template_name)] = cached
+                elif sha is not None:
+                    fetches[(project_name, template_name)] = executor.submit(bind(self.get_blob_content), sha)
+                elif truncated:
+                    # the tree listing was cut off by Github, fall back to the contents api for this template
+                    fetches[(project_name, template_name)] = executor.submit(
+                        bind(self.__get_file_content_or_none), project_name, template_name, branch)
+                else:
+                    contents[(project_name, template_name)] = None
+            for pair, fetch in fetches.items():
+                if errors is None:
+                    contents[pair] = fetch.result()
+                else:
+                    try:
+                        contents[pair] = fetch.result()
+                    except Exception as e:
+                        errors[pair] = e
+                        continue
+                sha = blobs.get("{0}/{1}".format(*pair))
+                if self.cache is not None and sha is not None and contents[pair] is not None:
+                    self.cache.put(("github",) + pair + (sha,), contents[pair])
+        return contents
+
+    def __get_file_entry(self, project_name, template_name, branch):
+        url = "{0}/contents/{1}/{2}?ref={3}".format(self.base_url, project_name, template_name, branch)
+        r = self.__request("GET", url)
         if r.status_code == 200:
-            print("Template already exists")
+            return r.json()
+        elif r.status_code == 404:
+            return None
         else:
-            print("Will create the file in github")
-            self.__create_file(url, data)
+            raise Exception(r.status_code)
+
+    def __get_file_content_or_none(self, project_name, template_name, branch):
+        entry = self.__get_file_entry(project_name, template_name, branch)
+        if entry is None:
+            return None
+        return base64.b64decode(entry["content"]).decode()
 
     def create_new_branch(self, master_branch, new_branch):
         # Creates a new branch if the new_branch does not exist
         url = "{0}/git/refs/heads/{1}".format(self.base_url, master_branch)
-        r = requests.get(url, headers=self.__github_headers())
+        r = self.__request("GET", url)
         if r.status_code == 200:
             sha = r.json()["object"]["sha"]
             url = "{0}/git/refs".format(self.base_url, master_branch)
-            r = requests.post(url, headers=self.__github_headers(),
-                              json={"ref": "refs/heads/{0}".format(new_branch), "sha": sha})
+            r = self.__request("POST", url, json={"ref": "refs/heads/{0}".format(new_branch), "sha": sha})
             if r.status_code == 201:
                 return r.json()
             else:
@@ -78,100 +245,425 @@ class Github(object):
         else:
             raise Exception(r.status_code)
 
-    def update_branch(self, template_content, template_name, project_name, branch):
-        url = "{0}/contents/{1}/{2}?ref={3}".format(self.base_url, project_name, template_name, branch)
-        r = requests.get(url, headers=self.__github_headers())
-        try:
-            sha = r.json()["sha"]
+    def __create_blob(self, content):
+        url = "{0}/git/blobs".format(self.base_url)
+        r = self.__request("POST", url, json={"content": base64.b64encode(content.encode()).decode(),
+                                              "encoding": "base64"})
+        if r.status_code == 201:
+            return r.json()["sha"]
+        else:
+            raise Exception(r.status_code)
 
-            url = "{0}/contents/{1}/{2}?ref={3}".format(self.base_url, project_name, template_name, branch)
-            payload = {"message": "update from flask app",
-                       "content": base64.b64encode(template_content.encode()).decode(),
-                       "sha": sha, "branch": branch}
-            r = requests.put(url, headers=self.__github_headers(), data=json.dumps(payload))
+    def commit_files(self, files, branch, message, max_workers=8, attempts=3):
+        """
+        Commits all files ({path: content}) to the branch as one commit with the Git Data API:
+        one blob upload per file, then a single tree, commit and ref update
+        If the branch moved while the commit was built, the commit is rebuilt on top of the new head
+        Files the branch already has with the same content are left out, returns None if nothing is left to commit
+        """
+        blobs, truncated = self.get_branch_tree(branch)
+        files = {path: content for path, content in files.items() if blobs.get(path) != git_blob_sha(content)}
+        if len(files) == 0:
+            return None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            blob_shas = dict(zip(files.keys(), executor.map(bind(self.__create_blob), files.values())))
+        tree = [{"path": path, "mode": "100644", "type": "blob", "sha": sha} for path, sha in blob_shas.items()]
+
+        ref_url = "{0}/git/refs/heads/{1}".format(self.base_url, branch)
+        for attempt in range(attempts):
+            r = self.__request("GET", ref_url)
+            if r.status_code != 200:
+                raise Exception(r.status_code)
+            parent_sha = r.json()["object"]["sha"]
+
+            r = self.__request("GET", "{0}/git/commits/{1}".format(self.base_url, parent_sha))
+            if r.status_code != 200:
+                raise Exception(r.status_code)
+            base_tree = r.json()["tree"]["sha"]
+
+            r = self.__request("POST", "{0}/git/trees".format(self.base_url),
+                               json={"base_tree": base_tree, "tree": tree})
+            if r.status_code != 201:
+                raise Exception(r.status_code)
+            tree_sha = r.json()["sha"]
+
+            r = self.__request("POST", "{0}/git/commits".format(self.base_url),
+                               json={"message": message, "tree": tree_sha, "parents": [parent_sha]})
+            if r.status_code != 201:
+                raise Exception(r.status_code)
+            commit_sha = r.json()["sha"]
+
+            r = self.__request("PATCH", ref_url, json={"sha": commit_sha})
             if r.status_code == 200:
-                return r.json()
-            else:
-                return r.status_code
-        except:
-            return r.status_code
+                for path in files:
+                    self.__invalidate(*path.split("/", 1))
+                return commit_sha
+            elif r.status_code != 422:
+                raise Exception(r.status_code)
+            # 422: the branch is no longer a fast forward of parent_sha, retry on the new head
+        raise Exception(422)
+
+    def get_open_pull_request(self, head, base):
+        # Returns the open pull request from head to base, or None
+        owner = self.base_url.rstrip("/").split("/")[-2]
+        url = "{0}/pulls?state=open&head={1}:{2}&base={3}".format(self.base_url, owner, head, base)
+        r = self.__request("GET", url)
+        if r.status_code == 200 and len(r.json()) > 0:
+            return r.json()[0]
+        return None
 
     def create_pull_request(self, head, base):
+        # an open pull request of the branch is reused, so a repeated run does not fail on the existing one
+        existing = self.get_open_pull_request(head, base)
+        if existing is not None:
+            return existing
         url = "{0}/pulls".format(self.base_url)
         data = {"head": head, "base": base, "title": "Pull request from flask app"}
-        r = requests.post(url, headers=self.__github_headers(), json=data)
+        r = self.__request("POST", url, json=data)
         if r.status_code == 201:
             return r.json()
         else:
             return r.status_code
 
 
+class StatusUpdates(object):
+    """
+    Collects the $set updates per template, merging all updates of a template into one,
+    and writes them as unordered bulk writes of batch_size templates
+    """
+
+    def __init__(self, collection, batch_size=500):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def set(self, name, new_value):
+        with self.lock:
+            self.pending.setdefault(name, {}).update(new_value)
+            if len(self.pending) < self.batch_size:
+                return
+            pending, self.pending = self.pending, {}
+        self.__write(pending)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        self.__write(pending)
+
+    def __write(self, pending):
+        if len(pending) == 0:
+            return
+        operations = [UpdateOne({"name": name}, {"$set": new_value}) for name, new_value in pending.items()]
+        self.collection.bulk_write(operations, ordered=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
 class LocalDatabase(object):
 
-    def __init__(self, cluster, database, collection):
-        self.cluster = MongoClient(database)
+    def __init__(self, cluster, database, collection, batch_size=500, clusters=("lab", "prod")):
+        self.cluster = MongoClient(database, event_listeners=[MongoListener()])
         self.database = self.cluster[cluster]
         self.collection = self.database[collection]
+        self.batch_size = batch_size
+        self.clusters = list(clusters)  # DNA Center clusters with a status in every entry
+        self.__migrate_legacy_status()
+        self.__create_indexes()
+
+    def __migrate_legacy_status(self):
+        """
+        Moves the inLab/inProd status, version and hash fields of an older database into the per cluster map
+        """
+        legacy = [field for fields in LEGACY_STATUS_FIELDS.values() for field in fields]
+        query = {"$or": [{field: {"$exists": True}} for field in legacy]}
+        if self.collection.find_one(query, {"_id": 1}) is None:
+            return
+        operations = []
+        for entry in self.collection.find(query, {field: 1 for field in legacy}):
+            new_value = {cluster_field(cluster, field): entry[old_field]
+                         for cluster, fields in LEGACY_STATUS_FIELDS.items()
+                         for old_field, field in fields.items() if old_field in entry}
+            operations.append(UpdateOne({"_id": entry["_id"]},
+                                        {"$set": new_value, "$unset": {field: "" for field in legacy}}))
+            if len(operations) >= self.batch_size:
+                self.collection.bulk_write(operations, ordered=False)
+                operations = []
+        if len(operations) > 0:
+            self.collection.bulk_write(operations, ordered=False)
+        for index in ("inLab_1_name_1", "inProd_1_name_1"):
+            try:
+                self.collection.drop_index(index)
+            except OperationFailure:
+                pass
+
+    def __create_indexes(self):
+        self.collection.create_index([("projectName", 1), ("name", 1)])
+        for cluster in self.clusters:
+            self.collection.create_index([(cluster_field(cluster, "status"), 1), ("name", 1)])
+        try:
+            self.collection.create_index("name", unique=True)
+        except OperationFailure as e:
+            # an existing database with duplicate template names keeps working without the index
+            print("Could not create the unique index on name: {0}".format(e))
 
-    def __create_entry(self, template):
+    def __new_entry(self, template):
         template['inGitHub'] = False
-        template['inLab'] = "NOT in Github"
-        template['inProd'] = "NOT in Github"
+        template['clusters'] = {cluster: {"status": "NOT in Github"} for cluster in self.clusters}
         template['createDate'] = datetime.now().strftime('%H:%M %m-%d-%Y')
-        self.collection.insert_one(template)
-
-    def get_templates_from_database(self):
-        templates = list(self.collection.find())
-        return templates
-
-    def update_db(self, name, new_value):
-        self.collection.update_one({'name': name}, {"$set": new_value}, upsert=False)
-        return 200, "Database has been updated"
-
-    def update_database(self, template_name, project_name, device_family, software_type):
-        template = {"name": template_name, "projectName": project_name,
-                    "deviceFamily": device_family, "softwareType": software_type}
-        if self.collection.count_documents({"name": template_name}) != 0:
-            print("Already inside database")
-            return {"update": False, "template": template_name}
-        else:
-            print("New entry will be created")
-            self.__create_entry(template)
-            return {"update": True, "template": template_name}
+        return template
+
+    def list_templates(self, fields=("name", "projectName", "clusters")):
+        """
+        Returns the templates sorted by name by the database, with only the given fields
+        """
+        return list(self.collection.find({}, {field: 1 for field in fields}).sort("name", 1))
+
+    def page_templates(self, query=None, fields=("name", "projectName", "clusters"), sort="name",
+                       direction=1, page=1, page_size=100):
+        """
+        Returns one page of the templates matching the query, sorted and projected by the database,
+        and the number of matching templates
+        """
+        query = query or {}
+        projection = dict({field: 1 for field in fields}, _id=0)
+        cursor = self.collection.find(query, projection).sort([(sort, direction), ("name", 1)])
+        templates = list(cursor.skip((page - 1) * page_size).limit(page_size))
+        return templates, self.collection.count_documents(query)
+
+    def get_templates_by_name(self, names, fields=None):
+        """
+        Returns {name: entry} for all the given template names with a single query
+        """
+        projection = None if fields is None else dict({field: 1 for field in fields}, name=1)
+        entries = self.collection.find({"name": {"$in": list(names)}}, projection)
+        return {entry["name"]: entry for entry in entries}
+
+    def get_template_metadata(self, names):
+        # projectName, deviceFamily, softwareType and cluster states of all the given templates with a single query
+        return self.get_templates_by_name(names, fields=["projectName", "deviceFamily", "softwareType", "clusters"])
+
+    def get_sync_state(self, name):
+        # State of the incremental sync (last synced commit, time of the last full sync), kept apart from templates
+        return self.database["sync_state"].find_one({"_id": name}) or {}
+
+    def set_sync_state(self, name, new_value):
+        self.database["sync_state"].update_one({"_id": name}, {"$set": new_value}, upsert=True)
+
+    def status_updates(self, batch_size=None):
+        # Batched status updates, use as a context manager so the last batch is flushed
+        return StatusUpdates(self.collection, batch_size or self.batch_size)
+
+    def checkpoints(self, operation_id, collection="checkpoints", ttl=7 * 24 * 3600):
+        # Per template progress of a resumable bulk operation
+        return Checkpoints(self.database[collection], operation_id, ttl)
+
+    def import_templates(self, templates):
+        """
+        Creates the entries that are not in the database yet with a single unordered bulk write of upserts,
+        existing entries are left untouched
+        templates: list of {"name", "projectName", "deviceFamily", "softwareType"}
+        Returns the names of the created entries
+        """
+        if len(templates) == 0:
+            return []
+        operations = [UpdateOne({"name": template["name"]}, {"$setOnInsert": self.__new_entry(dict(template))},
+                              upsert=True) for template in templates]
+        result = self.collection.bulk_write(operations, ordered=False)
+        return [templates[index]["name"] for index in sorted(result.upserted_ids)]
+
+
+class TokenManager(object):
+    """
+    Caches the DNA Center token of a cluster for the whole process
+    The token is fetched on first use and refreshed refresh_margin seconds before it expires: one thread refreshes
+    it in the background while the other threads keep using the current token, threads only wait for a login when
+    there is no valid token at all
+    """
+
+    __managers = {}
+    __managers_lock = threading.Lock()
+
+    @classmethod
+    def for_cluster(cls, base_url, username, login, lifetime=3600, refresh_margin=300):
+        with cls.__managers_lock:
+            key = (base_url, username)
+            if key not in cls.__managers:
+                cls.__managers[key] = cls(login, lifetime, refresh_margin)
+            return cls.__managers[key]
+
+    def __init__(self, login, lifetime=3600, refresh_margin=300):
+        self.login = login
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires = 0
+        self.__lock = threading.Lock()
+
+    def __refresh(self):
+        token = self.login()
+        self.token, self.expires = token, time.time() + self.lifetime
+
+    def __refresh_in_background(self):
+        # only one refresh at a time, skipped if another thread is already refreshing
+        if self.__lock.acquire(blocking=False):
+            def refresh():
+                try:
+                    self.__refresh()
+                except Exception as e:
+                    print("Token refresh failed: {0!r}".format(e))
+                finally:
+                    self.__lock.release()
+            threading.Thread(target=refresh, daemon=True).start()
+
+    def get(self):
+        token, expires = self.token, self.expires
+        now = time.time()
+        if token is not None and now < expires - self.refresh_margin:
+            return token
+        if token is not None and now < expires:
+            self.__refresh_in_background()
+            return token
+        with self.__lock:
+            if self.token is None or time.time() >= self.expires:
+                self.__refresh()
+            return self.token
+
+    def invalidate(self, token):
+        # Called on a 401, the next get() logs in again unless another thread already did
+        with self.__lock:
+            if self.token == token:
+                self.token, self.expires = None, 0
 
 
 class DNACenter(object):
 
-    def __init__(self, username, password, base_url, name):
+    def __init__(self, username, password, base_url, name, index_ttl=300, pool_size=10, retries=3,
+                 backoff_factor=0.5, token_lifetime=3600, token_refresh_margin=300, cache=None):
         self.username = username
         self.password = password
         self.base_url = base_url
-        self.name = name  # LAB OR PROD
-
-        self.__auth_token = self.__get_auth_token()
+        self.name = name  # cluster name, e.g. lab or prod
+        self.session = create_session(pool_size, retries, backoff_factor)
+        self.session.hooks["response"].append(response_hook("dnac_" + name.lower(), base_url))
+        self.cache = cache  # optional ContentCache
+
+        # project name -> project id and project id -> {template name: template id}, rebuilt after index_ttl seconds
+        self.index_ttl = index_ttl
+        # the template listings are fetched under a lock per project, the index lock is never held during a request
+        # to the listings, and a listing fetched while the index was dropped is not published
+        self.__index_lock = threading.Lock()
+        self.__project_lock = threading.Lock()
+        self.__listing_locks = {}
+        self.__projects = None
+        self.__project_templates = {}
+        self.__index_time = 0
+        self.__index_generation = 0
+
+        # the token is shared by all the DNACenter objects of the same cluster and user, and fetched on first use
+        self.__tokens = TokenManager.for_cluster(base_url, username, self.__get_auth_token, token_lifetime,
+                                                 token_refresh_margin)
 
     def __get_auth_token(self):
         url = '{0}/dna/system/api/v1/auth/token'.format(self.base_url)
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        r = requests.post(url, auth=HTTPBasicAuth(self.username, self.password), verify=False)
+        r = self.session.post(url, auth=HTTPBasicAuth(self.username, self.password), verify=False)
         if r.status_code == 200:
             response = r.json()
             return response['Token']
         else:
             raise Exception(r.status_code)
 
-    def __dna_headers(self):
-        return {'Content-Type': 'application/json', 'x-auth-token': self.__auth_token}
+    def __dna_headers(self, token):
+        return {'Content-Type': 'application/json', 'x-auth-token': token}
+
+    def __request(self, method, url, **kwargs):
+        # A 401 means the token expired early or was revoked: the request is retried once with a new token
+        token = self.__tokens.get()
+        r = self.session.request(method, url, headers=self.__dna_headers(token), **kwargs)
+        if r.status_code == 401:
+            self.__tokens.invalidate(token)
+            r = self.session.request(method, url, headers=self.__dna_headers(self.__tokens.get()), **kwargs)
+        return r
+
+    def refresh_index(self, project_id=None):
+        """
+        Drops the cached project/template index, or only the template listing of one project
+        Called at the start of a sync or push run and after the application creates templates
+        """
+        with self.__index_lock:
+            self.__index_generation += 1
+            if project_id is None:
+                self.__projects = None
+                self.__project_templates = {}
+            else:
+                self.__project_templates.pop(project_id, None)
 
     def __get_template_projects(self, project_name):
-        url = '%s/dna/intent/api/v1/template-programmer/project' % (self.base_url)
-        r = requests.get(url, headers=self.__dna_headers(), verify=False)
-        if r.status_code == 200 or 202:
-            for project in r.json():
-                if project_name == project['name']:
-                    return project['id']
-        else:
-            return False
+        with self.__index_lock:
+            if self.__projects is None or time.time() - self.__index_time > self.index_ttl:
+                url = '%s/dna/intent/api/v1/template-programmer/project' % (self.base_url)
+                r = self.__request("GET", url, verify=False)
+                if r.status_code not in (200, 202):
+                    raise Exception(r.status_code)
+                self.__projects = {project['name']: project['id'] for project in r.json()}
+                self.__project_templates = {}
+                self.__index_time = time.time()
+                self.__index_generation += 1
+            return self.__projects.get(project_name)
+
+    def __get_template_entry(self, project_name, template_name):
+        project_id = self.__get_template_projects(project_name=project_name)
+        if project_id is None:
+            return None, None
+        with self.__index_lock:
+            templates = self.__project_templates.get(project_id)
+            listing_lock = self.__listing_locks.setdefault(project_id, threading.Lock())
+        if templates is None:
+            # only the threads looking up the same project wait for its listing
+            with listing_lock:
+                with self.__index_lock:
+                    templates = self.__project_templates.get(project_id)
+                    generation = self.__index_generation
+                if templates is None:
+                    templates = self.__get_project_listing(project_id)
+                    with self.__index_lock:
+                        if self.__index_generation == generation:
+                            self.__project_templates[project_id] = templates
+        return project_id, templates.get(template_name)
+
+    def __get_project_listing(self, project_id):
+        url = "{0}/dna/intent/api/v1/template-programmer/template?projectId={1}".format(self.base_url, project_id)
+        r = self.__request("GET", url, auth=HTTPBasicAuth(self.username, self.password), verify=False)
+        if r.status_code not in (200, 202):
+            raise Exception(r.status_code)
+        return {t["name"]: t for t in r.json()}
+
+    def reload_listings(self, project_names):
+        """
+        Replaces the template listings of the given projects with fresh ones, the rest of the index is kept so the
+        running sync and push runs do not list their projects again
+        """
+        for project_name in project_names:
+            project_id = self.__get_template_projects(project_name=project_name)
+            if project_id is None:
+                continue
+            with self.__index_lock:
+                listing_lock = self.__listing_locks.setdefault(project_id, threading.Lock())
+            with listing_lock:
+                templates = self.__get_project_listing(project_id)
+                with self.__index_lock:
+                    self.__project_templates[project_id] = templates
+
+    def __get_template_id(self, project_name, template_name):
+        project_id, entry = self.__get_template_entry(project_name, template_name)
+        if entry is None:
+            return project_id, None
+        return project_id, entry["templateId"]
 
     def __create_template_data_ip(self, template_name, content, project_name, device_family, software_type):
         data = {
@@ -222,78 +714,121 @@ class DNACenter(object):
         }
         return data, "%s Automated Project" % project_name
 
+    def get_or_create_project(self, project_name):
+        # Serialized, so concurrent pushes into a new project create it only once
+        with self.__project_lock:
+            project_id = self.__get_template_projects(project_name=project_name)
+            if project_id is None:
+                # Create the project if it does not exists in the dna center prod
+                url = '%s/dna/intent/api/v1/template-programmer/project' % self.base_url
+                payload = self.__create_project_data(project_name)
+                r = self.__request("POST", url, verify=False, data=json.dumps(payload[0]))
+                # the project is created asynchronously, wait for the task before looking it up
+                task_id = TaskTracker.task_id(r.json())
+                if task_id is not None:
+                    tracker = TaskTracker(self, timeout=60)
+                    tracker.add(task_id, project_name)
+                    tracker.wait()
+                self.refresh_index()
+                project_id = self.__get_template_projects(project_name=project_name)
+            return project_id
+
     def create_template(self, template_name, template_content, project_name, device_family, software_type):
         print("--Inside Create Template--")
-        project_id = self.__get_template_projects(project_name=project_name)
-        if project_id is None:
-            # Create the project if it does not exists in the dna center prod
-            url = '%s/dna/intent/api/v1/template-programmer/project' % self.base_url
-            payload = self.__create_project_data(project_name)
-            r = requests.post(url, headers=self.__dna_headers(), verify=False, data=json.dumps(payload[0]))
-            project_id = self.__get_template_projects(project_name=project_name)
+        project_id = self.get_or_create_project(project_name)
 
         device_family = device_family[0]["productFamily"]
         payload = self.__create_template_data_ip(template_name, template_content, project_name, device_family,
                                                  software_type)
-        r = requests.post('%s/dna/intent/api/v1/template-programmer/project/%s/template' % (
-            self.base_url, project_id), headers=self.__dna_headers(), verify=False, data=json.dumps(payload[0]))
-        if r.status_code == 200 or 202:
+        r = self.__request("POST", '%s/dna/intent/api/v1/template-programmer/project/%s/template' % (
+            self.base_url, project_id), verify=False, data=json.dumps(payload[0]))
+        self.refresh_index(project_id)
+        self.invalidate_content(project_name, template_name)
+        if r.status_code in (200, 202):
             return r.json()
         else:
             return False
 
     def get_templates(self):
         url = "{0}/dna/intent/api/v1/template-programmer/template".format(self.base_url)
-        r = requests.get(url, headers=self.__dna_headers(), auth=HTTPBasicAuth(self.username, self.password),
-                         verify=False)
+        r = self.__request("GET", url, auth=HTTPBasicAuth(self.username, self.password), verify=False)
         if r.status_code == 200:
             return r.json()
         else:
             raise Exception(r.status_code)
 
+    def ping(self):
+        url = "{0}/dna/intent/api/v1/network-device/count".format(self.base_url)
+        r = self.__request("GET", url, verify=False)
+        if r.status_code != 200:
+            raise Exception(r.status_code)
+
+    def get_task(self, task_id):
+        url = "{0}/dna/intent/api/v1/task/{1}".format(self.base_url, task_id)
+        r = self.__request("GET", url, verify=False)
+        if r.status_code == 200:
+            return r.json()["response"]
+        else:
+            raise Exception(r.status_code)
+
     def get_template_details(self, template_id):
         url = "{0}/dna/intent/api/v1/template-programmer/template/{1}".format(self.base_url, template_id)
-        r = requests.get(url, headers=self.__dna_headers(), verify=False)
-        if r.status_code == 200 or 202:
+        r = self.__request("GET", url, verify=False)
+        if r.status_code in (200, 202):
             return r.json()
         else:
             raise Exception(r.status_code)
 
     def get_template_content_by_name(self, project_name, template_name):
-        project_id = self.__get_template_projects(project_name=project_name)
-        url = "{0}/dna/intent/api/v1/template-programmer/template?projectId={1}".format(self.base_url, project_id)
-        r = requests.get(url, headers=self.__dna_headers(), auth=HTTPBasicAuth(self.username, self.password),
-                         verify=False)
-        if r.status_code == 200 or 202:
-            projects = r.json()
-            for p in projects:
-                if p["name"] == template_name:
-                    templateId = p["templateId"]
-                    try:
-                        content = self.get_template_details(templateId)["templateContent"]
-                    except:
-                        content = ""
-                    return content
+        project_id, entry = self.__get_template_entry(project_name, template_name)
+        if entry is None:
             return 404
-        else:
+        version = self.__template_version(entry)
+        cache_key = (self.name.lower(), project_name, template_name, version)
+        if self.cache is not None and version is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                return content
+        # a failed lookup raises, an empty content would be taken for the template content
+        content = self.get_template_details(entry["templateId"])["templateContent"]
+        if self.cache is not None and version is not None:
+            self.cache.put(cache_key, content)
+        return content
+
+    def get_template_version(self, project_name, template_name):
+        """
+        Returns the latest committed version of the template from the template index, without downloading it
+        Returns 404 if the template does not exist and None if DNA Center does not report a version
+        """
+        project_id, entry = self.__get_template_entry(project_name, template_name)
+        if entry is None:
             return 404
+        return self.__template_version(entry)
+
+    def invalidate_content(self, project_name, template_name):
+        # Drops the cached contents of the template, a read during the write may have cached the old content
+        if self.cache is not None:
+            self.cache.invalidate(self.name.lower(), project_name, template_name)
+
+    def __template_version(self, entry):
+        versions = [int(v["version"]) for v in entry.get("versionsInfo") or [] if v.get("version")]
+        if len(versions) == 0:
+            return None
+        return max(versions)
 
     def update_template(self, template_name, template_content, project_name, device_family, software_type):
-        project_id = self.__get_template_projects(project_name=project_name)
+        project_id, template_id = self.__get_template_id(project_name, template_name)
+        if template_id is None:
+            return False
         device_family = device_family[0]["productFamily"]
-        url = "{0}/dna/intent/api/v1/template-programmer/template?projectId={1}".format(self.base_url, project_id)
-        r = requests.get(url, headers=self.__dna_headers(), auth=HTTPBasicAuth(self.username, self.password),
-                         verify=False)
-        if r.status_code == 200 or 202:
-            projects = r.json()
-            for p in projects:
-                if p["name"] == template_name:
-                    template_id = p["templateId"]
-                    payload = self.__update_template_data_ip(template_name, template_content, project_name,
-                                                             device_family, software_type, project_id, template_id)
-        r = requests.request("PUT", '%s/dna/intent/api/v1/template-programmer/template' % (
-            self.base_url), headers=self.__dna_headers(), verify=False, data=json.dumps(payload[0]))
-        if r.status_code == 200 or 202:
+        payload = self.__update_template_data_ip(template_name, template_content, project_name,
+                                                 device_family, software_type, project_id, template_id)
+        r = self.__request("PUT", '%s/dna/intent/api/v1/template-programmer/template' % (
+            self.base_url), verify=False, data=json.dumps(payload[0]))
+        # an update keeps the committed version the content is cached under, the cached content is dropped once
+        # written, and again by the caller once the DNA Center task is done
+        self.invalidate_content(project_name, template_name)
+        if r.status_code in (200, 202):
             return r.json()
         else:
             return False
@@ -0,0 +1,137 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimitScheduler(object):
+    """
+    Paces the requests of a client with a token bucket (rate requests per second, burst at most) and follows the
+    Github rate limit headers: when X-RateLimit-Remaining drops under min_remaining, the remaining quota is spread
+    until X-RateLimit-Reset, and rate limited answers (Retry-After, secondary rate limits) pause all requests
+    before they are retried
+    GETs are sent as conditional requests with the last ETag of the url, a 304 answer does not count against the
+    quota and returns the cached response. The cached responses are kept within etag_cache_size entries and
+    etag_cache_bytes of body, the least recently used are dropped first
+    """
+
+    def __init__(self, rate=10, burst=20, min_remaining=100, max_retries=3, etag_cache_size=2048,
+                 etag_cache_bytes=16 * 1024 * 1024):
+        self.rate = rate
+        self.burst = burst
+        self.min_remaining = min_remaining
+        self.max_retries = max_retries
+        self.etag_cache_size = etag_cache_size
+        self.etag_cache_bytes = etag_cache_bytes
+        self.etag_bytes = 0
+        self.tokens = burst
+        self.updated = time.time()
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0
+        self.etags = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "notModified": 0, "throttled": 0, "waitTime": 0.0}
+
+    def __current_rate(self, now):
+        if self.remaining is not None and self.reset is not None and self.remaining < self.min_remaining:
+            return min(self.rate, max(self.remaining, 1) / max(self.reset - now, 1))
+        return self.rate
+
+    def __acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    rate = self.__current_rate(now)
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / rate
+                self.stats["waitTime"] += wait
+            time.sleep(wait)
+
+    def __observe(self, r):
+        # Records the rate limit headers, returns True if the request was rate limited and has to be retried
+        now = time.time()
+        with self.lock:
+            if r.headers.get("X-RateLimit-Remaining") is not None:
+                self.remaining = int(r.headers["X-RateLimit-Remaining"])
+                self.reset = int(r.headers.get("X-RateLimit-Reset", now))
+            if r.status_code not in (403, 429):
+                return False
+            retry_after = r.headers.get("Retry-After")
+            if retry_after is not None:
+                wait = int(retry_after)
+            elif self.remaining == 0 and r.headers.get("X-RateLimit-Remaining") is not None:
+                wait = max(self.reset - now, 1)
+            elif "secondary rate limit" in r.text.lower():
+                wait = 60
+            else:
+                # a permission error, not a rate limit
+                return False
+            self.blocked_until = max(self.blocked_until, now + wait)
+            self.stats["throttled"] += 1
+            return True
+
+    def request(self, session, method, url, headers, **kwargs):
+        headers = dict(headers)
+        cached = None
+        if method == "GET":
+            with self.lock:
+                cached = self.etags.get(url)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+
+        for attempt in range(self.max_retries + 1):
+            self.__acquire()
+            r = session.request(method, url, headers=headers, **kwargs)
+            with self.lock:
+                self.stats["requests"] += 1
+            if not self.__observe(r):
+                break
+
+        with self.lock:
+            if r.status_code == 304 and cached is not None:
+                self.stats["notModified"] += 1
+                if url in self.etags:
+                    # the entry may have been dropped while the request was sent
+                    self.etags.move_to_end(url)
+                return cached[1]
+            if method == "GET" and r.status_code == 200 and r.headers.get("ETag"):
+                self.__remember(url, r)
+        return r
+
+    def __remember(self, url, r):
+        # called with the lock held, a response larger than the whole budget is not kept
+        if url in self.etags:
+            self.etag_bytes -= len(self.etags.pop(url)[1].content)
+        size = len(r.content)
+        if size > self.etag_cache_bytes:
+            return
+        self.etags[url] = (r.headers["ETag"], r)
+        self.etag_bytes += size
+        while len(self.etags) > self.etag_cache_size or self.etag_bytes > self.etag_cache_bytes:
+            self.etag_bytes -= len(self.etags.popitem(last=False)[1][1].content)
+
+    def throttle_stats(self):
+        with self.lock:
+            return dict(self.stats, remaining=self.remaining, reset=self.reset,
+                        blocked=round(max(self.blocked_until - time.time(), 0), 1))
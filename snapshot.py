@@ -0,0 +1,247 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import argparse
+import io
+import json
+import sys
+import tarfile
+import time
+from datetime import datetime
+
+from env_var import *
+
+from clients import clusters, content_cache, db, github
+from models import cluster_field, git_blob_sha
+from sync_engine import BoundedExecutor
+from template_diff import normalize
+from update_database import sync_status
+
+MANIFEST = "manifest.json"
+
+
+def blob_name(sha):
+    return "blobs/{0}/{1}".format(sha[:2], sha)
+
+
+class SnapshotWriter(object):
+    """
+    Writes a gzip compressed tar archive as a stream: every content once under blobs/ (named by its git blob sha),
+    then the manifest with the metadata and the blob shas of every template
+    """
+
+    def __init__(self, path):
+        self.archive = tarfile.open(path, "w:gz")
+        self.written = set()
+        self.templates = []
+
+    def add_content(self, content):
+        # Returns the sha of the content, the content is only written the first time it is seen
+        if content is None or content == 404:
+            return None
+        sha = git_blob_sha(content)
+        if sha not in self.written:
+            self.__add_file(blob_name(sha), content.encode())
+            self.written.add(sha)
+        return sha
+
+    def add_template(self, template):
+        self.templates.append(template)
+
+    def close(self, **manifest):
+        manifest = dict(manifest, version=1, blobs=len(self.written), templates=self.templates)
+        self.__add_file(MANIFEST, json.dumps(manifest, indent=1, default=str).encode())
+        self.archive.close()
+
+    def __add_file(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.archive.addfile(info, io.BytesIO(data))
+
+
+class Snapshot(object):
+    """
+    Reads a snapshot archive: the manifest is loaded when opened, the contents are read on demand
+    """
+
+    def __init__(self, path):
+        self.archive = tarfile.open(path, "r:gz")
+        self.manifest = json.load(self.archive.extractfile(MANIFEST))
+        self.templates = {template["name"]: template for template in self.manifest["templates"]}
+
+    def content(self, sha):
+        if sha is None:
+            return None
+        return self.archive.extractfile(blob_name(sha)).read().decode()
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_snapshot(path, chunk_size=DB_BATCH_SIZE, progress=None):
+    """
+    Writes the inventory of the database with the template contents of Github (main branch) and of every
+    DNA Center cluster to a snapshot, chunk_size templates at a time so only one chunk of contents is in memory
+    DNA Center contents come from the content cache when their version was already downloaded
+    """
+    entries = db.list_templates(fields=("name", "projectName", "deviceFamily", "softwareType"))
+    clusters.refresh_indexes()
+    head = github.get_branch_head("main")
+    writer = SnapshotWriter(path)
+    with BoundedExecutor(clusters.limits("sync")) as executor:
+        for start in range(0, len(entries), chunk_size):
+            chunk = entries[start:start + chunk_size]
+            pairs = [(entry["projectName"], entry["name"]) for entry in chunk]
+            fetches = {(cluster, pair): (executor.submit(cluster, dnac.get_template_version, *pair),
+                                         executor.submit(cluster, dnac.get_template_content_by_name, *pair))
+                       for pair in pairs for cluster, dnac in clusters.items()}
+            github_contents = github.get_many(pairs, max_workers=SYNC_CONCURRENCY["github"])
+
+            for entry, pair in zip(chunk, pairs):
+                template = {"name": entry["name"], "projectName": entry["projectName"],
+                            "deviceFamily": entry.get("deviceFamily"), "softwareType": entry.get("softwareType"),
+                            "github": writer.add_content(github_contents.get(pair)), "clusters": {}}
+                for cluster in clusters:
+                    version, content = [fetch.result() for fetch in fetches[(cluster, pair)]]
+                    template["clusters"][cluster] = {"version": version, "hash": writer.add_content(content)}
+                writer.add_template(template)
+            if progress is not None:
+                progress(min(start + chunk_size, len(entries)), len(entries))
+
+    writer.close(created=datetime.now().strftime('%H:%M %m-%d-%Y'), githubCommit=head, clusters=list(clusters))
+    return "Snapshot of {0} templates ({1} distinct contents) written to {2}".format(
+        len(entries), len(writer.written), path)
+
+
+def template_status(snapshot, template, cluster):
+    """
+    Sync status of a template in a cluster computed from the snapshot alone, with the same rules as the sync:
+    hashes first, then the normalized contents for the templates whose hashes differ
+    """
+    state = template["clusters"].get(cluster, {"version": 404, "hash": None})
+    if template["github"] is None:
+        return "NOT in Github"
+    status = sync_status(state["version"], state["hash"], template["github"])
+    if status == "NOT In Sync" and state["hash"] is not None:
+        if normalize(snapshot.content(state["hash"]), DIFF_IGNORE_PATTERNS) == normalize(
+                snapshot.content(template["github"]), DIFF_IGNORE_PATTERNS):
+            return "In Sync"
+    return status
+
+
+def import_snapshot(path, progress=None):
+    """
+    Warm start from a snapshot: creates the missing database entries, records the cluster versions, hashes and
+    status of every template (so the next incremental sync only downloads what changed since), and loads the
+    contents into the content cache under the keys the clients look up
+    """
+    with Snapshot(path) as snapshot:
+        templates = snapshot.manifest["templates"]
+        added = db.import_templates([{"name": template["name"], "projectName": template["projectName"],
+                                      "deviceFamily": template["deviceFamily"],
+                                      "softwareType": template["softwareType"]} for template in templates])
+        with db.status_updates() as updates:
+            for i, template in enumerate(templates):
+                new_value = {"githubSha": template["github"]}
+                for cluster, state in template["clusters"].items():
+                    if cluster not in clusters:
+                        continue
+                    new_value[cluster_field(cluster, "version")] = state["version"]
+                    new_value[cluster_field(cluster, "hash")] = state["hash"]
+                    new_value[cluster_field(cluster, "status")] = template_status(snapshot, template, cluster)
+                    if state["hash"] is not None:
+                        content_cache.put((cluster, template["projectName"], template["name"], state["version"]),
+                                          snapshot.content(state["hash"]))
+                if template["github"] is not None:
+                    content_cache.put(("github", template["projectName"], template["name"], template["github"]),
+                                      snapshot.content(template["github"]))
+                updates.set(template["name"], new_value)
+                if progress is not None:
+                    progress(i + 1, len(templates))
+
+    return "Snapshot of {0} templates imported, {1} new database entries".format(len(templates), len(added))
+
+
+def drift_report(path, other_path=None):
+    """
+    Offline drift report: the sync status of every template and cluster in a snapshot, or the templates whose
+    Github or cluster content changed between two snapshots
+    Returns {"summary": {...}, "templates": {name: {...}}} with only the drifted/changed templates listed
+    """
+    with Snapshot(path) as snapshot:
+        if other_path is None:
+            summary, drifted = {}, {}
+            for name, template in snapshot.templates.items():
+                for cluster in snapshot.manifest["clusters"]:
+                    status = template_status(snapshot, template, cluster)
+                    summary.setdefault(cluster, {}).setdefault(status, 0)
+                    summary[cluster][status] += 1
+                    if status != "In Sync":
+                        drifted.setdefault(name, {})[cluster] = status
+            return {"summary": summary, "templates": drifted}
+
+        with Snapshot(other_path) as other:
+            changed = {}
+            sources = ["github"] + sorted(set(snapshot.manifest["clusters"]) | set(other.manifest["clusters"]))
+            for name in sorted(set(snapshot.templates) | set(other.templates)):
+                before, after = snapshot.templates.get(name), other.templates.get(name)
+                if before is None or after is None:
+                    changed[name] = {"template": "added" if before is None else "removed"}
+                    continue
+                for source in sources:
+                    if source == "github":
+                        old, new = before["github"], after["github"]
+                    else:
+                        old = before["clusters"].get(source, {}).get("hash")
+                        new = after["clusters"].get(source, {}).get("hash")
+                    if old != new:
+                        changed.setdefault(name, {})[source] = "added" if old is None else (
+                            "removed" if new is None else "changed")
+            summary = {source: sum(1 for sources_changed in changed.values() if source in sources_changed)
+                       for source in sources}
+            return {"summary": summary, "templates": changed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports, imports and compares template inventory snapshots")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    commands.add_parser("export", help="writes a snapshot from the database, Github and DNA Center").add_argument(
+        "path")
+    commands.add_parser("import", help="fills the database and the content cache from a snapshot").add_argument(
+        "path")
+    drift = commands.add_parser("drift", help="sync status from a snapshot, or the changes between two snapshots")
+    drift.add_argument("path")
+    drift.add_argument("other_path", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(export_snapshot(args.path))
+    elif args.command == "import":
+        print(import_snapshot(args.path))
+    else:
+        json.dump(drift_report(args.path, args.other_path), sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,143 +12,259 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
-from flask import Flask, request, render_template
+import hashlib
+import json
+import math
+import os
+
+from flask import Flask, Response, request, render_template, jsonify, stream_with_context
 
 from env_var import *
 
-from models import DNACenter, LocalDatabase, Github
+from checkpoints import operation_id
+from clients import clusters, db, github, job_store, health
+from jobs import JobManager
+from metrics import metrics
+from models import cluster_field
+from template_diff import DiffCache, stream_diff
 from webex_notification import send_notification
-from update_database import update_database, sync_templates, update_branch
+from update_database import update_database, sync_templates, sync_incremental, update_branch, push_templates, \
+    changed_in_dnac
+from watcher import ChangeWatcher, pushed_templates, verify_signature
 
 app = Flask(__name__)
 
-DNACenterLab = DNACenter(username=DNAC_USER, password=DNAC_PASS, base_url=DNAC_URL, name="Lab")
-DNACenterProd = DNACenter(username=DNAC_USER_PROD, password=DNAC_PASS_PROD, base_url=DNAC_URL_PROD, name="Prod")
-db = LocalDatabase(cluster=Cluster1, database=Database1, collection=Collection1)
-github = Github(base_url=GITHUB_URL, token=GITHUB_TOKEN)
+# the clients connect on first use, so the app starts even if a backend is unreachable
+diffs = DiffCache(max_entries=DIFF_CACHE_SIZE)
+jobs = JobManager(job_store, workers=JOB_WORKERS, heartbeat_interval=JOB_HEARTBEAT_INTERVAL,
+                  heartbeat_timeout=JOB_HEARTBEAT_TIMEOUT)
+
+
+def selected_or_all(templates):
+    # all the templates are used if none of the templates has been selected
+    if templates is None:
+        return db.list_templates(fields=("name", "projectName"))
+    return templates
+
+
+def push_job(templates, push_to, progress):
+    # the same push started again after a failure resumes from its checkpoints
+    return push_templates(templates, push_to, progress,
+                          operation_id=operation_id("push", templates=templates, push_to=push_to))
+
+
+def update_branch_job(templates, progress):
+    message = update_branch(selected_or_all(templates), progress,
+                            operation_id=operation_id("update_branch", templates=templates))
+    send_notification(message)
+    return message
+
+
+def sync_job(templates, progress, full=False, notify=True):
+    # without a selection only the templates changed since the last sync are checked
+    if templates is None:
+        message = sync_incremental(progress, full=full)
+    else:
+        message = sync_templates(templates, progress)
+    if notify:
+        send_notification(message)
+    return message
+
+
+def update_database_job(progress):
+    message = update_database(progress)
+    send_notification(message)
+    return message
+
+
+jobs.register("push", push_job)
+jobs.register("update_branch", update_branch_job)
+jobs.register("sync", sync_job)
+jobs.register("update_database", update_database_job)
+
+
+def dnac_changes():
+    # templates whose version moved in a DNA Center cluster since their last sync, read from fresh listings
+    return changed_in_dnac(db.list_templates(fields=("name", "projectName", "clusters")), reload_listings=True)
+
+
+watcher = ChangeWatcher(jobs, poll=dnac_changes, debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY,
+                        poll_interval=DNAC_POLL_INTERVAL)
+
+
+def start_background():
+    """
+    Starts the job workers and, with WATCH_CHANGES, the change watcher of this process
+    Called once the app is started (not on import), from the process that serves the requests
+    """
+    jobs.start()
+    if WATCH_CHANGES:
+        watcher.start()
+
+LIST_FIELDS = ("name", "projectName", "clusters", "deviceFamily", "softwareType", "createDate", "updateDate")
+# the status of a cluster is filtered and sorted by the cluster name: ?prod=NOT In Sync&sort=prod
+STATUS_FIELDS = {cluster: cluster_field(cluster, "status") for cluster in clusters}
+FILTER_FIELDS = dict({"project": "projectName"}, **STATUS_FIELDS)
+SORT_FIELDS = dict({field: field for field in LIST_FIELDS if field != "clusters"}, **STATUS_FIELDS)
+
+
+@app.context_processor
+def cluster_labels():
+    return {"clusters": [(cluster, clusters.label(cluster)) for cluster in clusters],
+            "source_label": clusters.label(DNAC_SOURCE_CLUSTER)}
+
+
+def template_listing(args):
+    """
+    Builds one page of the template listing from the request arguments:
+    page, page_size, sort, order (asc/desc), fields (comma separated) and the filters project and <cluster> (status)
+    """
+    filters = {arg: args[arg] for arg in FILTER_FIELDS if args.get(arg)}
+    query = {FILTER_FIELDS[arg]: value for arg, value in filters.items()}
+    sort = args.get("sort") if args.get("sort") in SORT_FIELDS else "name"
+    order = "desc" if args.get("order") == "desc" else "asc"
+    page = max(args.get("page", 1, type=int), 1)
+    page_size = min(max(args.get("page_size", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    fields = [field for field in args.get("fields", "").split(",") if field in LIST_FIELDS]
+    fields = fields or ["name", "projectName", "clusters"]
+    # only the status of the clusters is listed, not their versions and hashes
+    if "clusters" in fields:
+        fields = [field for field in fields if field != "clusters"] + list(STATUS_FIELDS.values())
+
+    templates, total = db.page_templates(query, fields=fields, sort=SORT_FIELDS[sort],
+                                         direction=-1 if order == "desc" else 1, page=page, page_size=page_size)
+    return {"templates": templates, "total": total, "page": page, "pageSize": page_size,
+            "pages": max(int(math.ceil(total / float(page_size))), 1), "sort": sort, "order": order,
+            "filters": filters}
+
+
+def conditional(response, listing):
+    # the ETag is the hash of the listing, so an unchanged listing is answered with 304 Not Modified
+    etag = hashlib.sha1(json.dumps(listing, sort_keys=True, default=str).encode()).hexdigest()
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 
 @app.route("/")
 def main_page():
-    templates = db.get_templates_from_database()
-    all_templates = sorted(templates, key=lambda k: k['name'])
-    return render_template("columnPage.html", content=all_templates)
+    listing = template_listing(request.args)
+    response = app.make_response(render_template("columnPage.html", content=listing["templates"],
+                                                 listing=listing))
+    return conditional(response, listing)
+
+
+@app.route("/api/templates")
+def template_list():
+    listing = template_listing(request.args)
+    return conditional(jsonify(listing), listing)
 
 
 @app.route("/selection", methods=['POST', 'GET'])
 def main_page_selected():
-    templates = db.get_templates_from_database()
-    all_templates = sorted(templates, key=lambda k: k['name'])
+    listing = template_listing(request.args)
+    all_templates = listing["templates"]
 
     if request.method == 'POST':
         form_data = request.form
         button_pushed = form_data["submit_button"]
+        selected_templates = form_data.getlist("template") or None
+
+        try:
+            if button_pushed == "Push Templates":
+                if selected_templates is None:
+                    return render_template("columnPage.html", content=all_templates, listing=listing, success=False,
+                                           message="Please select templates to update DNA Center",
+                                           button=button_pushed)
+                job = jobs.enqueue("push", {"templates": selected_templates,
+                                            "push_to": form_data["input-type-push"]})
+            elif button_pushed == "Update Development Branch":
+                job = jobs.enqueue("update_branch", {"templates": selected_templates})
+            elif button_pushed == "Sync":
+                job = jobs.enqueue("sync", {"templates": selected_templates,
+                                            "full": form_data.get("full_sync") == "full"})
+            else:
+                job = jobs.enqueue("update_database", {})
+        except:
+            return render_template("columnPage.html", content=all_templates, listing=listing, success=False,
+                                   message="Please contact IT team", button=button_pushed)
+
+        return render_template("columnPage.html", content=all_templates, listing=listing, job=job,
+                               message="{0} is {1}".format(button_pushed, job["status"]), button=button_pushed)
+
+    return render_template("columnPage.html", content=all_templates, listing=listing)
+
+
+@app.route("/webhooks/github", methods=["POST"])
+def github_webhook():
+    """
+    Github push webhook: the templates changed on the main branch are synced once the pushes settle
+    """
+    if not verify_signature(GITHUB_WEBHOOK_SECRET, request.get_data(), request.headers.get("X-Hub-Signature-256")):
+        return jsonify({"error": "Invalid signature"}), 401
+    if request.headers.get("X-GitHub-Event") != "push":
+        return jsonify({"status": "ignored"})
+    names = pushed_templates(request.get_json(force=True))
+    known = list(db.get_templates_by_name(list(names), fields=[]).keys())
+    watcher.notify(known)
+    return jsonify({"status": "queued", "templates": sorted(known)}), 202
+
+
+@app.route("/health")
+def health_check():
+    backends = health(timeout=HEALTH_TIMEOUT)
+    status = 200 if all(backend["status"] == "up" for backend in backends.values()) else 503
+    return jsonify(backends), status
+
+
+@app.route("/stats/github")
+def github_stats():
+    return jsonify(github.throttle_stats())
+
+
+@app.route("/metrics")
+def backend_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/jobs")
+def job_list():
+    return jsonify(jobs.list())
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/diff/<template_name>")
+def template_diff(template_name):
+    """
+    Streams the unified diff between the Github content and the content of a template in a DNA Center cluster
+    (?against=<cluster>)
+    """
+    against = request.args.get("against", DNAC_SOURCE_CLUSTER)
+    dnac = clusters[against] if against in clusters else None
+    metadata = db.get_templates_by_name([template_name], fields=["projectName"]).get(template_name)
+    if dnac is None or metadata is None:
+        return jsonify({"error": "Template or DNA Center cluster not found"}), 404
+
+    project_name = metadata["projectName"]
+    github_content = github.get_many([(project_name, template_name)]).get((project_name, template_name))
+    dnac_content = dnac.get_template_content_by_name(project_name, template_name)
+    if github_content is None or dnac_content == 404:
+        return jsonify({"error": "Template not found in Github or DNA Center " + against}), 404
 
-        if button_pushed == "Push Templates":
-            try:
-                push_to = form_data["input-type-push"]
-                selected_templates = form_data.getlist("template")
-                if push_to == "lab":
-                    for template_name in selected_templates:
-                        project_name = db.collection.find({"name": template_name})[0]["projectName"]
-                        device_family = db.collection.find({"name": template_name})[0]["deviceFamily"]
-                        software_type = db.collection.find({"name": template_name})[0]["softwareType"]
-
-                        template_content = github.get_github_file_content(template_name=template_name,
-                                                                          project_name=project_name)
-                        dnac_prod_content = DNACenterLab.get_template_content_by_name(project_name, template_name)
-                        if dnac_prod_content == 404:
-                            print("Will Push Template to Github: \n")
-                            DNACenterLab.create_template(template_name=template_name, template_content=template_content,
-                                                          project_name=project_name, device_family=device_family,
-                                                          software_type=software_type)
-                            new_value = {"inLab": "*View on DNAC Lab*"}
-                            db.update_db(template_name, new_value)
-                        else:
-
-                            print('Will Update Template: \n')
-                            DNACenterLab.update_template(template_name=template_name, template_content="test content",
-                                                          project_name=project_name, device_family=device_family, software_type=software_type)
-                            new_value = {"inLab": "*View on DNAC Lab*"}
-                            db.update_db(template_name, new_value)
-                else:
-
-                    for template_name in selected_templates:
-                        project_name = db.collection.find({"name": template_name})[0]["projectName"]
-                        device_family = db.collection.find({"name": template_name})[0]["deviceFamily"]
-                        software_type = db.collection.find({"name": template_name})[0]["softwareType"]
-                        template_content = github.get_github_file_content(template_name=template_name,
-                                                                          project_name=project_name)
-                        dnac_prod_content = DNACenterProd.get_template_content_by_name(project_name, template_name)
-                        if dnac_prod_content == 404:
-                            print("Will Push Template to Github: \n")
-                            DNACenterProd.create_template(template_name=template_name, template_content=template_content,
-                                                          project_name=project_name, device_family=device_family,
-                                                          software_type=software_type)
-                            new_value = {"inProd": "*View on DNAC Prod*"}
-                            db.update_db(template_name, new_value)
-                        else:
-
-                            print('Will Update Template: \n')
-                            DNACenterProd.update_template(template_name=template_name, template_content="test content",
-                                                          project_name=project_name, device_family=device_family, software_type=software_type)
-                            new_value = {"inProd": "*View on DNAC Lab*"}
-                            db.update_db(template_name, new_value)
-
-                message = "Pushed templates " + ', '.join(selected_templates) + " from Github to " + push_to
-                result = True
-                if len(selected_templates) == 0:
-                    message = "Please select templates to update DNA Center"
-                    result = False
-            except:
-                message = "Please contact IT team"
-                result = False
-
-        elif button_pushed == "Update Development Branch":
-            try:
-                selected_templates = form_data.getlist("template")
-
-                # check all the templates if none of the templates has been selected
-                if len(selected_templates) == 0:
-                    message = update_branch(all_templates)
-                else:
-                    message = update_branch(selected_templates)
-                send_notification(message)
-                result = True
-            except:
-                message = "Please contact IT team"
-                result = False
-
-        elif button_pushed == "Sync":
-            try:
-                selected_templates = form_data.getlist("template")
-                # check all the templates if none of the templates has been selected
-                if len(selected_templates) == 0:
-                    message = sync_templates(all_templates)
-                else:
-                    message = sync_templates(selected_templates)
-                send_notification(message)
-                result = True
-            except:
-                message = "Please contact IT team"
-                result = False
-
-        else:
-            try:
-                message = update_database()
-                send_notification(message)
-                result = True
-            except:
-                message = "Please contact IT team"
-                result = False
-
-        templates = db.get_templates_from_database()
-        all_templates = sorted(templates, key=lambda k: k['name'])
-        return render_template("columnPage.html", content=all_templates, success=result, message=message,
-                               button=button_pushed)
-
-    return render_template("columnPage.html", content=all_templates)
+    lines = stream_diff(github_content, dnac_content, "github/{0}/{1}".format(project_name, template_name),
+                        "{0}/{1}/{2}".format(against, project_name, template_name),
+                        ignore_patterns=DIFF_IGNORE_PATTERNS, cache=diffs)
+    return Response(stream_with_context(lines), mimetype="text/plain")
 
 
 if __name__ == "__main__":
+    # the debug reloader runs the app in a child process, only that one starts the background threads
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background()
     app.run(debug=True)
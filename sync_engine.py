@@ -0,0 +1,41 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import bind
+
+
+class BoundedExecutor(object):
+    """
+    Runs calls on one thread pool per backend, so every backend (Github, DNA Center Lab, DNA Center Prod)
+    has its own concurrency limit and a slow backend cannot starve the others
+    """
+
+    def __init__(self, limits):
+        self.pools = {backend: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=backend)
+                      for backend, limit in limits.items()}
+
+    def submit(self, backend, func, *args, **kwargs):
+        return self.pools[backend].submit(bind(func), *args, **kwargs)
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,96 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import bind
+
+
+class TaskTracker(object):
+    """
+    Waits for the tasks returned by DNA Center create/update calls
+    One poller checks at most batch_size outstanding tasks each round, rotating through the outstanding tasks, and
+    backs off once a whole rotation finished no task: the interval doubles up to max_interval and drops back to
+    min_interval on progress
+    """
+
+    def __init__(self, dnac, batch_size=10, min_interval=0.5, max_interval=10, timeout=300):
+        self.dnac = dnac
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.outstanding = {}
+        self.results = {}
+
+    @staticmethod
+    def task_id(response):
+        # create/update return {"response": {"taskId": ..., "url": ...}, "version": ...}
+        try:
+            return response["response"]["taskId"]
+        except (KeyError, TypeError):
+            return None
+
+    def add(self, task_id, name, start_time=None):
+        # start_time is when the task was requested, the latency is measured from then
+        self.outstanding[task_id] = {"name": name, "startTime": start_time or time.time()}
+
+    def __poll(self, task_id):
+        try:
+            return task_id, self.dnac.get_task(task_id)
+        except Exception as e:
+            print("Polling task {0} failed: {1!r}".format(task_id, e))
+            return task_id, None
+
+    def __finish(self, task_id, status, reason=None):
+        task = self.outstanding.pop(task_id)
+        self.results[task["name"]] = {"taskId": task_id, "status": status, "reason": reason,
+                                      "latency": round(time.time() - task["startTime"], 2)}
+
+    def wait(self, progress=None):
+        """
+        Returns {name: {"taskId", "status" (done, failed or timeout), "reason", "latency" in seconds}}
+        """
+        total = len(self.outstanding) + len(self.results)
+        interval = self.min_interval
+        deadline = time.time() + self.timeout
+        # tasks polled since the last one finished, the poller backs off once all the outstanding tasks were polled
+        unfinished = 0
+        with ThreadPoolExecutor(max_workers=self.batch_size) as executor:
+            while len(self.outstanding) > 0 and time.time() < deadline:
+                time.sleep(interval)
+                finished = 0
+                batch = list(self.outstanding)[:self.batch_size]
+                for task_id, task in executor.map(bind(self.__poll), batch):
+                    if task is not None and task.get("isError"):
+                        self.__finish(task_id, "failed", task.get("failureReason") or task.get("progress"))
+                        finished += 1
+                    elif task is not None and task.get("endTime"):
+                        self.__finish(task_id, "done")
+                        finished += 1
+                    else:
+                        # the task goes to the end of the rotation
+                        self.outstanding[task_id] = self.outstanding.pop(task_id)
+                unfinished = 0 if finished > 0 else unfinished + len(batch)
+                if finished > 0:
+                    interval = self.min_interval
+                elif unfinished >= len(self.outstanding):
+                    interval = min(interval * 2, self.max_interval)
+                if progress is not None:
+                    progress(len(self.results), total)
+        for task_id in list(self.outstanding):
+            self.__finish(task_id, "timeout", "No result after {0} seconds".format(self.timeout))
+        return self.results
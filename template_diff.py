@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import difflib
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+
+def normalize(content, ignore_patterns=()):
+    """
+    Normalizes the content before comparing: line endings, trailing whitespace, leading/trailing blank lines
+    and the lines matching ignore_patterns (headers injected by DNA Center) are ignored
+    """
+    patterns = [re.compile(pattern) for pattern in ignore_patterns]
+    lines = [line.rstrip() for line in content.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    lines = [line for line in lines if not any(pattern.search(line) for pattern in patterns)]
+    while len(lines) > 0 and lines[0] == "":
+        lines.pop(0)
+    while len(lines) > 0 and lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def normalized_hash(content, ignore_patterns=()):
+    return hashlib.sha1("\n".join(normalize(content, ignore_patterns)).encode()).hexdigest()
+
+
+class DiffCache(object):
+    """
+    LRU cache of computed diffs keyed by the pair of content hashes
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            lines = self.entries.get(key)
+            if lines is not None:
+                self.entries.move_to_end(key)
+            return lines
+
+    def put(self, key, lines):
+        with self.lock:
+            self.entries[key] = lines
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def stream_diff(from_content, to_content, from_name, to_name, ignore_patterns=(), cache=None):
+    """
+    Yields the unified diff of the normalized contents line by line, so large diffs can be streamed
+    The diff is cached by the hashes of both contents once it has been streamed completely
+    """
+    key = (hashlib.sha1(from_content.encode()).hexdigest(), hashlib.sha1(to_content.encode()).hexdigest(),
+           from_name, to_name)
+    lines = None if cache is None else cache.get(key)
+    if lines is not None:
+        for line in lines:
+            yield line
+        return
+
+    lines = []
+    for line in difflib.unified_diff(normalize(from_content, ignore_patterns), normalize(to_content, ignore_patterns),
+                                     fromfile=from_name, tofile=to_name, lineterm=""):
+        lines.append(line + "\n")
+        yield line + "\n"
+    if cache is not None:
+        cache.put(key, lines)
@@ -12,87 +12,268 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 from env_var import *
 
-from models import DNACenter, LocalDatabase, Github
+from clients import clusters, db, github
+from metrics import bind
+from checkpoints import resumed
+from models import cluster_field, git_blob_sha
+from sync_engine import BoundedExecutor
+from task_tracker import TaskTracker
+from template_diff import normalize
 
-DNACenterLab = DNACenter(username=DNAC_USER, password=DNAC_PASS, base_url=DNAC_URL, name="Lab")
-DNACenterProd = DNACenter(username=DNAC_USER_PROD, password=DNAC_PASS_PROD, base_url=DNAC_URL_PROD, name="Prod")
-db = LocalDatabase(cluster=Cluster1, database=Database1, collection=Collection1)
-github = Github(base_url=GITHUB_URL, token=GITHUB_TOKEN)
 
+def resolve_templates(templates):
+    """
+    Templates are either passed as names (selected in the GUI) or as database entries (all templates)
+    Returns the project name and the template name of every template, looked up with a single query
+    """
+    names = [template for template in templates if not isinstance(template, dict)]
+    entries = db.get_templates_by_name(names, fields=["projectName"])
+    pairs = []
+    for template in templates:
+        if isinstance(template, dict):
+            pairs.append((template["projectName"], template["name"]))
+        elif template in entries:
+            pairs.append((entries[template]["projectName"], template))
+    return pairs
 
-def sync_templates(templates):
+
+def dnac_state(dnac, project_name, template_name, recorded):
     """
-    The template content is compared between: Github, DNA Center Lab and DNA Center Prod
-    The sync status is updated in the database
+    Returns the version, content hash and content of the template in a DNA Center cluster
+    The content is only downloaded if the version differs from the one recorded for the cluster in the database
+    entry ({"version", "hash"}), otherwise the recorded hash is reused and the content is None
     """
-    for template_name in templates:
-        print(template_name)
-        try:
-            project_name = db.collection.find({"name": template_name})[0]["projectName"]
-        except:
-            project_name = template_name["projectName"]
-            template_name = template_name["name"]
+    version = dnac.get_template_version(project_name, template_name)
+    if version == 404:
+        return 404, None, None
+    if version is not None and version == recorded.get("version") and recorded.get("hash"):
+        return version, recorded["hash"], None
+    content = dnac.get_template_content_by_name(project_name, template_name)
+    if content == 404:
+        return 404, None, None
+    return version, git_blob_sha(content), content
+
+
+def sync_status(dnac_version, dnac_hash, github_sha):
+    if dnac_version == 404:
+        return "Not Found"
+    elif dnac_hash == github_sha:
+        return "In Sync"
+    else:
+        return "NOT In Sync"
+
 
-        # Check if the template is in github
+def recheck_normalized(executor, drifted, failed=None):
+    """
+    Templates whose hashes differ are compared again after normalization (line endings, trailing whitespace,
+    DNA Center headers), so formatting-only differences are not reported as NOT In Sync
+    drifted is a list of (project name, template name, cluster, content or None)
+    Returns the (template name, cluster) pairs that are in sync once normalized, the templates whose contents could
+    not be downloaded stay NOT In Sync and are added to the failed list if one is given
+    """
+    errors = {}
+    github_contents = github.get_many(list(set((project_name, template_name)
+                                               for project_name, template_name, cluster, content in drifted)),
+                                      errors=errors)
+    fetches = []
+    for project_name, template_name, cluster, content in drifted:
+        if content is None:
+            content = executor.submit(cluster, clusters[cluster].get_template_content_by_name, project_name,
+                                      template_name)
+        fetches.append((project_name, template_name, cluster, content))
+
+    in_sync = []
+    for project_name, template_name, cluster, content in fetches:
         try:
-            github_content = github.get_github_file_content(project_name, template_name)
-            dnac_lab_content = DNACenterLab.get_template_content_by_name(project_name, template_name)
-            dnac_prod_content = DNACenterProd.get_template_content_by_name(project_name, template_name)
-
-            # Update the DNA Center Status
-            if dnac_lab_content == 404:
-                new_value = {"inLab": "Not Found"}
-            elif dnac_lab_content == github_content:
-                new_value = {"inLab": "In Sync"}
-            else:
-                new_value = {"inLab": "NOT In Sync"}
-            db.update_db(template_name, new_value)
-
-            # Update the DNA Prod Status
-            if dnac_prod_content == 404:
-                new_value = {"inProd": "Not Found"}
-            elif dnac_prod_content == github_content:
-                new_value = {"inProd": "In Sync"}
-            else:
-                new_value = {"inProd": "NOT In Sync"}
-            db.update_db(template_name, new_value)
+            if (project_name, template_name) in errors:
+                raise errors[(project_name, template_name)]
+            if not isinstance(content, str):
+                content = content.result()
+        except Exception as e:
+            print("Could not compare {0} in {1}: {2!r}".format(template_name, cluster, e))
+            if failed is not None and template_name not in failed:
+                failed.append(template_name)
+            continue
+        github_content = github_contents.get((project_name, template_name))
+        if content == 404 or github_content is None:
+            continue
+        if normalize(content, DIFF_IGNORE_PATTERNS) == normalize(github_content, DIFF_IGNORE_PATTERNS):
+            in_sync.append((template_name, cluster))
+    return in_sync
+
 
-            # Update the Last Update time in database
-            today = datetime.now().strftime('%H:%M %m-%d-%Y')
-            new_value = {"updateDate": today}
-            db.update_db(template_name, new_value)
+def sync_templates(templates, progress=None, failed=None):
+    """
+    The template content is compared between Github and every DNA Center cluster
+    Contents are compared by hash: the Github blob shas come from one tree request and DNA Center content is only
+    downloaded when its version moved since the last run. The clusters are queried in parallel, each bounded by
+    its own sync concurrency
+    Templates whose hashes differ are compared again with normalized content, the Github sha found equal is recorded
+    with the cluster hash (normalizedSha) so the pair is not downloaded and normalized again by the next syncs
+    The sync status of every cluster is updated in the database, the templates that could not be checked keep
+    their recorded status and are added to the failed list if one is given
+    """
+    failed_templates = []
+    clusters.refresh_indexes()
+    pairs = resolve_templates(templates)
+    entries = db.get_templates_by_name([template_name for project_name, template_name in pairs],
+                                       fields=["clusters"])
+    with BoundedExecutor(clusters.limits("sync")) as executor, db.status_updates() as updates:
+        fetches = []
+        for project_name, template_name in pairs:
+            recorded = entries.get(template_name, {}).get("clusters", {})
+            fetches.append((project_name, template_name,
+                            {cluster: executor.submit(cluster, dnac_state, dnac, project_name, template_name,
+                                                      recorded.get(cluster, {}))
+                             for cluster, dnac in clusters.items()}))
+        # the Github blob shas are resolved while the DNA Center lookups are running
+        github_shas = github.get_shas(pairs)
 
-        except:
-            new_value = {"inLab": "NOT in Github"}
-            db.update_db(template_name, new_value)
-            new_value = {"inProd": "NOT in Github"}
-            db.update_db(template_name, new_value)
+        drifted = []
+        for i, (project_name, template_name, cluster_fetches) in enumerate(fetches):
+            print(template_name)
+            # Check if the template is in github
+            try:
+                github_sha = github_shas[(project_name, template_name)]
+                new_value = {}
+                recorded = entries.get(template_name, {}).get("clusters", {})
+                for cluster, fetch in cluster_fetches.items():
+                    version, dnac_hash, content = fetch.result()
+                    # the versions are recorded in any case, so the incremental sync does not check them again
+                    new_value[cluster_field(cluster, "version")] = version
+                    if github_sha is None:
+                        new_value[cluster_field(cluster, "status")] = "NOT in Github"
+                        continue
+                    # the status is stored with the hash it was computed from
+                    status = sync_status(version, dnac_hash, github_sha)
+                    if status == "NOT In Sync" and recorded.get(cluster, {}).get("hash") == dnac_hash and \
+                            recorded.get(cluster, {}).get("normalizedSha") == github_sha:
+                        # the same contents were found in sync once normalized by a previous sync
+                        status = "In Sync"
+                    new_value[cluster_field(cluster, "status")] = status
+                    new_value[cluster_field(cluster, "hash")] = dnac_hash
+                    if status == "NOT In Sync":
+                        drifted.append((project_name, template_name, cluster, content))
 
+                # Update the Last Update time in database
+                if github_sha is not None:
+                    new_value["updateDate"] = datetime.now().strftime('%H:%M %m-%d-%Y')
+                    new_value["githubSha"] = github_sha
+                updates.set(template_name, new_value)
+
+            except Exception as e:
+                # a failed lookup leaves the recorded status as it is, the template is checked again next time
+                print("Could not check {0}: {1!r}".format(template_name, e))
+                failed_templates.append(template_name)
+
+            finally:
+                if progress is not None:
+                    progress(i + 1, len(fetches))
+
+        if len(drifted) > 0:
+            shas = {template_name: github_shas[(project_name, template_name)] for project_name, template_name in pairs}
+            for template_name, cluster in recheck_normalized(executor, drifted, failed_templates):
+                updates.set(template_name, {cluster_field(cluster, "status"): "In Sync",
+                                            cluster_field(cluster, "normalizedSha"): shas[template_name]})
+
+    if failed is not None:
+        failed.extend(failed_templates)
     message = "Template status sync update has been completed"
+    if len(failed_templates) > 0:
+        message += ". Could not check: {0}".format(', '.join(failed_templates))
     return message
 
 
-def update_database():
+def changed_in_dnac(entries, reload_listings=False):
     """
-    Create or update a database entry for the templates in DNA Center
+    Returns the names of the templates whose version in a DNA Center cluster differs from the version recorded
+    in the database, read from the template indexes (one listing per project and cluster)
+    The indexes are rebuilt, or with reload_listings only the listings of the compared projects are replaced, so
+    the indexes of the running jobs are kept
     """
-    labTemplates = DNACenterLab.get_templates()
-    addedTemplates = []
+    if reload_listings:
+        clusters.reload_listings(sorted(set(entry["projectName"] for entry in entries)))
+    else:
+        clusters.refresh_indexes()
+    changed = set()
+    for entry in entries:
+        recorded = entry.get("clusters", {})
+        for cluster, dnac in clusters.items():
+            version = dnac.get_template_version(entry["projectName"], entry["name"])
+            if "version" not in recorded.get(cluster, {}) or version != recorded[cluster]["version"]:
+                changed.add(entry["name"])
+    return changed
+
 
-    for temp in labTemplates:
-        temp_details = DNACenterLab.get_template_details(temp["templateId"])
-        template_name = temp_details["name"]
-        project_name = temp_details["projectName"]
-        device_family = temp_details["deviceTypes"]
+def sync_incremental(progress=None, full=False):
+    """
+    Only syncs the templates touched by Github commits since the last sync (compare api) or whose DNA Center
+    version changed. A full sync runs the first time, every FULL_SYNC_INTERVAL seconds and whenever Github
+    cannot list the changes
+    The templates that could not be checked are kept in the sync state and checked again by the next run, as the
+    last synced commit moves on without them
+    """
+    state = db.get_sync_state("github")
+    head = github.get_branch_head("main")
+    entries = db.list_templates(fields=("name", "projectName", "clusters"))
 
-        software_type = temp_details["softwareType"]
-        updated = db.update_database(template_name, project_name, device_family, software_type)
-        if updated["update"]:
-            addedTemplates.append(updated["template"])
+    changed_files = None
+    if not full and state.get("commitSha") and time.time() - state.get("lastFullSync", 0) < FULL_SYNC_INTERVAL:
+        changed_files = github.get_changed_files(state["commitSha"], head)
+
+    failed = []
+    if changed_files is None:
+        message = sync_templates(entries, progress, failed)
+        db.set_sync_state("github", {"commitSha": head, "lastFullSync": time.time(), "failedTemplates": failed})
+        return message
+
+    changed = changed_in_dnac(entries) | set(state.get("failedTemplates", []))
+    touched = [entry for entry in entries if entry["name"] in changed
+               or "{0}/{1}".format(entry["projectName"], entry["name"]) in changed_files]
+    if len(touched) > 0:
+        sync_templates(touched, progress, failed)
+    db.set_sync_state("github", {"commitSha": head, "failedTemplates": failed})
+    message = "Template status sync update has been completed, {0} changed templates checked".format(len(touched))
+    if len(failed) > 0:
+        message += ". Could not check: {0}".format(', '.join(failed))
+    return message
+
+
+def template_metadata(template):
+    return {"name": template["name"], "projectName": template["projectName"],
+            "deviceFamily": template["deviceTypes"], "softwareType": template["softwareType"]}
+
+
+def update_database(progress=None):
+    """
+    Create or update a database entry for the templates in the source DNA Center cluster
+    The template details are only fetched, in parallel, for new templates whose list entry lacks the metadata
+    """
+    source = clusters[DNAC_SOURCE_CLUSTER]
+    labTemplates = source.get_templates()
+    existing = db.get_templates_by_name([temp["name"] for temp in labTemplates], fields=[])
+    new_templates = [temp for temp in labTemplates if temp["name"] not in existing]
+
+    entries = []
+    with BoundedExecutor(clusters.limits("sync", [DNAC_SOURCE_CLUSTER])) as executor:
+        fetches = []
+        for temp in new_templates:
+            if all(field in temp for field in ("projectName", "deviceTypes", "softwareType")):
+                entries.append(template_metadata(temp))
+            else:
+                fetches.append(executor.submit(DNAC_SOURCE_CLUSTER, source.get_template_details, temp["templateId"]))
+        for i, fetch in enumerate(fetches):
+            entries.append(template_metadata(fetch.result()))
+            if progress is not None:
+                progress(i + 1, len(fetches))
+
+    addedTemplates = db.import_templates(entries)
 
     if len(addedTemplates) > 0:
         message = "Added Templates to Database: " + ', '.join(addedTemplates)
@@ -101,46 +282,263 @@ def update_database():
     return message
 
 
-def update_branch(templates):
+def operation_checkpoints(operation_id):
+    # checkpoints of a resumable operation, None runs the operation without checkpoints
+    if operation_id is None:
+        return None
+    return db.checkpoints(operation_id, CHECKPOINT_COLLECTION, CHECKPOINT_TTL)
+
+
+def update_branch(templates, progress=None, operation_id=None):
     """
-    Pushes the selected templates to Github development branch (the branch will be created if it does not exists)
-    Creates a pull request if a template is changed/created
+    Pushes the selected templates of the source DNA Center cluster to Github development branch
+    (the branch will be created if it does not exists)
+    All changed/created templates are pushed as one commit, then a pull request is created
+    With an operation_id every template is checkpointed with its Lab hash once committed (or found unchanged): a run
+    that failed part way is resumed by running it again with the same operation_id, the templates are only skipped
+    while their Lab content is still the one they were checkpointed with
     """
     same_templates = []
+    resumed_templates = []
     changed_templates = []
     added_templates = []
+    failed_templates = {}
+    same_hashes = {}
+    files = {}
+    lab_states = {}
+    source = clusters[DNAC_SOURCE_CLUSTER]
+    source.refresh_index()
 
-    for template_name in templates:
-        try:
-            project_name = db.collection.find({"name": template_name})[0]["projectName"]
-        except:
-            project_name = template_name["projectName"]
-            template_name = template_name["name"]
-
-        dnac_lab_content = DNACenterLab.get_template_content_by_name(project_name, template_name)
+    checkpoints = operation_checkpoints(operation_id)
+    completed = checkpoints.completed() if checkpoints is not None else {}
+    committed_before = 0
+    pairs = resolve_templates(templates)
+    entries = db.get_templates_by_name([template_name for project_name, template_name in pairs],
+                                       fields=[cluster_field(DNAC_SOURCE_CLUSTER, "version"),
+                                               cluster_field(DNAC_SOURCE_CLUSTER, "hash")])
+    github_shas = github.get_shas(pairs)
 
+    for i, (project_name, template_name) in enumerate(pairs):
+        if progress is not None:
+            progress(i, len(pairs))
         try:
-            github_content = github.get_github_file_content(project_name, template_name)
+            recorded = entries.get(template_name, {}).get("clusters", {}).get(DNAC_SOURCE_CLUSTER, {})
+            lab_version, lab_hash, dnac_lab_content = dnac_state(source, project_name, template_name, recorded)
+            github_sha = github_shas[(project_name, template_name)]
 
-            if dnac_lab_content == github_content:
+            if lab_version == 404:
+                print("Template not found in " + clusters.label(DNAC_SOURCE_CLUSTER))
+                continue
+            if resumed(completed, template_name, lab_hash):
+                resumed_templates.append(template_name)
+                if completed[template_name].get("result") == "committed":
+                    committed_before += 1
+                continue
+            if github_sha is not None and lab_hash == github_sha:
                 print("The content is the same, no need to update the branch")
                 same_templates.append(template_name)
-            else:
-                # a new branch will be created with the updated content
-                github.create_new_branch(master_branch="main", new_branch="development")
-                github.update_branch(dnac_lab_content, template_name, project_name, branch="development")
-                changed_templates.append(template_name)
-
-        except:
-            # initial github entry will be created on github
-            github.create_new_branch(master_branch="main", new_branch="development")
-            github.add_template_github(dnac_lab_content, template_name, project_name)
+                same_hashes[template_name] = lab_hash
+                continue
+
+            if dnac_lab_content is None:
+                dnac_lab_content = source.get_template_content_by_name(project_name, template_name)
+        except Exception as e:
+            print("Could not read {0} from {1}: {2!r}".format(template_name, DNAC_SOURCE_CLUSTER, e))
+            failed_templates[template_name] = repr(e)
+            continue
+
+        files["{0}/{1}".format(project_name, template_name)] = dnac_lab_content
+        if github_sha is None:
             added_templates.append(template_name)
-            print("Pushed template to github")
+        else:
+            changed_templates.append(template_name)
+        lab_states[template_name] = {cluster_field(DNAC_SOURCE_CLUSTER, "version"): lab_version,
+                                     cluster_field(DNAC_SOURCE_CLUSTER, "hash"): lab_hash}
 
-    if len(changed_templates) > 0 or len(added_templates) > 0:
+    # the checkpoints of the templates read in this run are written together
+    if checkpoints is not None:
+        checkpoints.done(same_hashes, "same")
+        checkpoints.fail(failed_templates)
+
+    if len(files) > 0:
+        # a new branch will be created and all the changed/new templates are pushed as a single commit, a rerun
+        # leaves out the files the branch already has so committing again is idempotent
+        github.create_new_branch(master_branch="main", new_branch="development")
+        github.commit_files(files, branch="development", message="Update {0} templates from flask app".format(
+            len(files)), max_workers=SYNC_CONCURRENCY["github"])
+        print("Pushed templates to github")
+        if checkpoints is not None:
+            checkpoints.done({template_name: new_value[cluster_field(DNAC_SOURCE_CLUSTER, "hash")]
+                              for template_name, new_value in lab_states.items()}, "committed")
+        with db.status_updates() as updates:
+            for template_name, new_value in lab_states.items():
+                updates.set(template_name, new_value)
+    if progress is not None:
+        progress(len(pairs), len(pairs))
+
+    # the templates committed by a previous run of the operation still need the pull request
+    if len(changed_templates) + len(added_templates) + committed_before > 0:
         github.create_pull_request(base="main", head="development")
         message = "Pull Request has been created on Github. Please review the changes."
     else:
         message = "Github is upto date."
+    if len(resumed_templates) > 0:
+        message += " {0} templates were already done by the previous run.".format(len(resumed_templates))
+    if len(failed_templates) > 0:
+        message += " Failed: {0}. Run the update again to retry them.".format(', '.join(sorted(failed_templates)))
+    elif checkpoints is not None:
+        checkpoints.clear()
     return message
+
+
+def push_template(dnac, template_name, template_content, project_name, metadata, recorded=None):
+    """
+    Creates the template in DNA Center, or updates it if the template index already has it
+    Returns "created" or "updated", the task response of DNA Center, the committed version the content was
+    pushed onto (None for a new template) and the time the push started, or "unchanged" when the version recorded
+    for the cluster ({"version", "hash"}) is still the latest one and already has the Github content
+    """
+    start_time = time.time()
+    version = dnac.get_template_version(project_name, template_name)
+    if recorded is not None and version not in (404, None) and version == recorded.get("version") and \
+            recorded.get("hash") == git_blob_sha(template_content):
+        print("The content is the same, no need to push {0}".format(template_name))
+        return "unchanged", None, version, start_time
+    if version == 404:
+        print("Will Push Template to DNA Center: \n")
+        response = dnac.create_template(template_name=template_name, template_content=template_content,
+                                        project_name=project_name, device_family=metadata["deviceFamily"],
+                                        software_type=metadata["softwareType"])
+        return "created", response, None, start_time
+    else:
+        print('Will Update Template: \n')
+        response = dnac.update_template(template_name=template_name, template_content=template_content,
+                                        project_name=project_name, device_family=metadata["deviceFamily"],
+                                        software_type=metadata["softwareType"])
+        return "updated", response, version, start_time
+
+
+def push_targets(push_to):
+    # push_to is a cluster name, a list of cluster names or "all"
+    if push_to == "all":
+        return list(clusters)
+    if isinstance(push_to, str):
+        return [push_to]
+    return [cluster for cluster in push_to if cluster in clusters]
+
+
+def push_templates(templates, push_to, progress=None, operation_id=None):
+    """
+    Creates or updates the selected templates in one, several or all DNA Center clusters with the content from Github
+    The Github contents are prefetched once, then the templates are pushed to all the clusters in parallel, each
+    bounded by its own push concurrency, and the DNA Center tasks of every cluster are tracked until they are finished
+    With an operation_id every "cluster/template" push is checkpointed with the Github blob sha once its task is
+    done: running the operation again with the same operation_id skips the pushes done with the current Github
+    content and retries the others
+    """
+    targets = push_targets(push_to)
+    clusters.refresh_indexes(targets)
+    checkpoints = operation_checkpoints(operation_id)
+    completed = checkpoints.completed() if checkpoints is not None else {}
+
+    metadata = db.get_template_metadata(templates)
+    pairs = [(metadata[template_name]["projectName"], template_name) for template_name in templates
+             if template_name in metadata]
+    github_contents = github.get_many(pairs, max_workers=SYNC_CONCURRENCY["github"])
+    not_in_github = [template_name for project_name, template_name in pairs
+                     if github_contents[(project_name, template_name)] is None]
+    github_shas = {pair[1]: git_blob_sha(github_contents[pair]) for pair in pairs if github_contents[pair] is not None}
+
+    results = {cluster: {"created": [], "updated": [], "unchanged": [], "failed": [], "latencies": []}
+               for cluster in targets}
+    with BoundedExecutor(clusters.limits("push", targets)) as executor, db.status_updates() as updates:
+        pushes = {}
+        resumed_pushes = 0
+        for cluster in targets:
+            for project_name, template_name in pairs:
+                template_content = github_contents[(project_name, template_name)]
+                if template_content is None:
+                    continue
+                if resumed(completed, "{0}/{1}".format(cluster, template_name), github_shas[template_name]):
+                    resumed_pushes += 1
+                    continue
+                recorded = metadata[template_name].get("clusters", {}).get(cluster, {})
+                push = executor.submit(cluster, push_template, clusters[cluster], template_name, template_content,
+                                       project_name, metadata[template_name], recorded)
+                pushes[push] = (cluster, template_name)
+
+        # the pushes are only reported once DNA Center finished their tasks
+        trackers = {cluster: TaskTracker(clusters[cluster], batch_size=TASK_POLL_BATCH, timeout=TASK_TIMEOUT)
+                    for cluster in targets}
+        pushed = {}
+        # the pushes are read as they finish, their task latency is measured from the start of the push
+        for i, push in enumerate(as_completed(pushes)):
+            cluster, template_name = pushes[push]
+            try:
+                result, response, version, start_time = push.result()
+                if result == "unchanged":
+                    results[cluster]["unchanged"].append(template_name)
+                    if checkpoints is not None:
+                        checkpoints.done({"{0}/{1}".format(cluster, template_name): github_shas[template_name]}, result)
+                    if progress is not None:
+                        progress(i + 1, len(pushes))
+                    continue
+                task_id = TaskTracker.task_id(response)
+                if task_id is None:
+                    raise Exception("No task returned: {0!r}".format(response))
+                trackers[cluster].add(task_id, template_name, start_time)
+                pushed[(cluster, template_name)] = (result, version)
+            except Exception as e:
+                print("Push of {0} to {1} failed: {2!r}".format(template_name, cluster, e))
+                results[cluster]["failed"].append(template_name)
+                if checkpoints is not None:
+                    checkpoints.fail({"{0}/{1}".format(cluster, template_name): repr(e)})
+            if progress is not None:
+                progress(i + 1, len(pushes))
+
+        # the clusters are waited for in parallel, the task progress is only reported for a single cluster
+        with ThreadPoolExecutor(max_workers=len(targets)) as waiter:
+            waits = {cluster: waiter.submit(bind(trackers[cluster].wait), progress if len(targets) == 1 else None)
+                     for cluster in targets}
+            for cluster, wait in waits.items():
+                for template_name, task in wait.result().items():
+                    # the content read while the task was running may have been cached under the same version
+                    clusters[cluster].invalidate_content(metadata[template_name]["projectName"], template_name)
+                    if task["status"] == "done":
+                        result, version = pushed[(cluster, template_name)]
+                        results[cluster][result].append(template_name)
+                        results[cluster]["latencies"].append(task["latency"])
+                        # DNA Center only adds a version on commit: the pushed content is recorded with the version
+                        # it was pushed onto, so the next sync and push see the content the cluster now has
+                        updates.set(template_name, {cluster_field(cluster, "status"):
+                                                    "*View on {0}*".format(clusters.label(cluster)),
+                                                    cluster_field(cluster, "version"): version,
+                                                    cluster_field(cluster, "hash"): github_shas[template_name]})
+                        if checkpoints is not None:
+                            checkpoints.done({"{0}/{1}".format(cluster, template_name): github_shas[template_name]},
+                                             result)
+                    else:
+                        results[cluster]["failed"].append("{0} ({1})".format(template_name, task["reason"]))
+                        if checkpoints is not None:
+                            checkpoints.fail({"{0}/{1}".format(cluster, template_name): task["reason"]})
+
+    messages = []
+    for cluster in targets:
+        result = results[cluster]
+        message = "Pushed templates " + ', '.join(result["created"] + result["updated"]) + " from Github to " + \
+            clusters.label(cluster)
+        for key, label in (("created", "Created"), ("updated", "Updated"), ("unchanged", "Unchanged"),
+                           ("failed", "Failed")):
+            if len(result[key]) > 0:
+                message += ". {0}: {1}".format(label, ', '.join(result[key]))
+        if len(result["latencies"]) > 0:
+            message += ". DNA Center completed the tasks in {0:.1f}s on average, {1:.1f}s at most".format(
+                sum(result["latencies"]) / len(result["latencies"]), max(result["latencies"]))
+        messages.append(message + ".")
+    if len(not_in_github) > 0:
+        messages.append("NOT in Github: {0}.".format(', '.join(not_in_github)))
+    if resumed_pushes > 0:
+        messages.append("{0} pushes were already done by the previous run.".format(resumed_pushes))
+    if checkpoints is not None and not any(len(results[cluster]["failed"]) > 0 for cluster in targets):
+        checkpoints.clear()
+    return " ".join(messages)
@@ -0,0 +1,105 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+
+import hashlib
+import hmac
+import threading
+import time
+
+
+def verify_signature(secret, body, signature):
+    # Github signs the webhook body with the secret: X-Hub-Signature-256 = "sha256=" + hmac sha256 hex digest
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return signature is not None and hmac.compare_digest(expected, signature)
+
+
+def pushed_templates(payload, branch="main"):
+    """
+    Returns the template names (project/template paths) added, modified or removed by a Github push event on branch
+    """
+    if payload.get("ref") != "refs/heads/" + branch:
+        return set()
+    names = set()
+    for commit in payload.get("commits", []):
+        for path in commit.get("added", []) + commit.get("modified", []) + commit.get("removed", []):
+            if "/" in path:
+                names.add(path.split("/", 1)[1])
+    return names
+
+
+class ChangeWatcher(object):
+    """
+    Collects the templates changed in Github (push webhooks) and in DNA Center (poll() every poll_interval seconds)
+    and enqueues one sync job for them once no change arrived for debounce seconds, or at the latest max_delay
+    seconds after the first change, so a burst of pushes results in a single targeted sync
+    """
+
+    def __init__(self, jobs, poll=None, debounce=10, max_delay=60, poll_interval=300):
+        self.jobs = jobs
+        self.poll = poll
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+        self.last_poll = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def notify(self, names):
+        names = set(names)
+        if len(names) == 0:
+            return
+        with self.lock:
+            now = time.time()
+            self.pending |= names
+            self.first_change = self.first_change or now
+            self.last_change = now
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            # the first poll waits for poll_interval, the syncs already record the current versions
+            self.last_poll = time.time()
+            self.thread = threading.Thread(target=self.__watch, name="change-watcher", daemon=True)
+            self.thread.start()
+
+    def flush(self, force=False):
+        # Enqueues the sync of the pending templates once the changes settled, returns the job or None
+        with self.lock:
+            now = time.time()
+            if len(self.pending) == 0 or not (force or now - self.last_change >= self.debounce
+                                              or now - self.first_change >= self.max_delay):
+                return None
+            names, self.pending, self.first_change, self.last_change = self.pending, set(), None, None
+        try:
+            return self.jobs.enqueue("sync", {"templates": sorted(names), "notify": False})
+        except Exception as e:
+            print("Could not enqueue the sync of the changed templates: {0!r}".format(e))
+            self.notify(names)
+            return None
+
+    def __watch(self):
+        while True:
+            if self.poll is not None and time.time() - self.last_poll >= self.poll_interval:
+                self.last_poll = time.time()
+                try:
+                    self.notify(self.poll())
+                except Exception as e:
+                    print("Could not poll DNA Center for changes: {0!r}".format(e))
+            self.flush()
+            time.sleep(1)
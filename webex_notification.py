@@ -15,7 +15,9 @@ or implied.
 from webexteamssdk import WebexTeamsAPI
 from env_var import WEBEX_ACCESS_TOKEN
 
-api = WebexTeamsAPI(access_token=WEBEX_ACCESS_TOKEN)
+from clients import register
+
+api = register("webex", lambda: WebexTeamsAPI(access_token=WEBEX_ACCESS_TOKEN), probe=lambda client: client.people.me())
 
 def send_notification(message):
     to = ' '